@@ -48,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Does nothing unless PROFILING_ENABLED is set
+    "social.profiling.ProfilingMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -82,16 +84,49 @@ ASGI_APPLICATION = "backend.asgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# How database connections are reused between requests:
+#   "psycopg": a pool of DB_POOL_MIN_SIZE to DB_POOL_MAX_SIZE connections per
+#              process. The only mode that suits ASGI servers such as Daphne,
+#              which run requests on threads that come and go.
+#   "persistent": every thread keeps its connection for DB_CONN_MAX_AGE
+#                 seconds, for gunicorn's sync and gthread workers only
+#   "pgbouncer": persistent connections to a PgBouncer in transaction mode at
+#                POSTGRES_HOST and POSTGRES_PORT, for the same workers
+# gunicorn_config.py sizes its workers to fit these.
+DB_POOL = os.getenv("DB_POOL", "psycopg")
+# Seconds a connection is kept, 0 opens a new one for every request
+DB_CONN_MAX_AGE = int(os.getenv("DB_CONN_MAX_AGE", 60))
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 8))
+# Seconds a request waits for a pooled connection before it fails
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 10))
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.postgresql",
         "NAME": os.getenv("POSTGRES_DB"),
         "USER": os.getenv("POSTGRES_USER"),
         "PASSWORD": os.getenv("POSTGRES_PASSWORD"),
-        "HOST": "db",
-        "PORT": "5432",
+        "HOST": os.getenv("POSTGRES_HOST", "db"),
+        "PORT": os.getenv("POSTGRES_PORT", "5432"),
+        # 0 with the psycopg pool, which keeps the connections itself
+        "CONN_MAX_AGE": 0 if DB_POOL == "psycopg" else DB_CONN_MAX_AGE,
+        # Replaces a kept connection the server has dropped instead of failing
+        "CONN_HEALTH_CHECKS": True,
     }
 }
+if DB_POOL == "psycopg":
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": DB_POOL_MIN_SIZE,
+            "max_size": DB_POOL_MAX_SIZE,
+            "timeout": DB_POOL_TIMEOUT,
+        }
+    }
+elif DB_POOL == "pgbouncer":
+    # In transaction mode PgBouncer may hand the next query of a connection to
+    # another server connection, where a server-side cursor does not exist
+    DATABASES["default"]["DISABLE_SERVER_SIDE_CURSORS"] = True
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -138,18 +173,45 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
+    "formatters": {
+        # Request profiles are logged as one JSON object per line
+        "message": {"format": "{message}", "style": "{"},
+    },
     "handlers": {
         "console": {
             "class": "logging.StreamHandler",
         },
+        "profiling": {
+            "class": "logging.StreamHandler",
+            "formatter": "message",
+        },
     },
     "root": {
         "handlers": ["console"],
         "level": "INFO",
     },
+    "loggers": {
+        "social.profiling": {
+            "handlers": ["profiling"],
+            "level": "INFO",
+            "propagate": False,
+        },
+    },
 }
 
+# Per-request timings in logs, Server-Timing headers and /api/metrics, see
+# social.profiling
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "False") == "True"
+# Requests running longer than this get their stack logged
+PROFILING_SLOW_MS = int(os.getenv("PROFILING_SLOW_MS", 500))
+# Fraction of requests run under cProfile, logged when they turn out slow
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", 0))
+# Bearer token a metrics scraper sends to /api/metrics, which otherwise only
+# answers staff users. Empty allows no scraper.
+PROFILING_METRICS_TOKEN = os.getenv("PROFILING_METRICS_TOKEN", "")
+
 CORS_ORIGIN_ALLOW_ALL = True
+CORS_EXPOSE_HEADERS = ["X-Next-Cursor", "X-Unread-Count", "ETag", "Last-Modified"]
 
 # CORS_ALLOWED_ORIGINS = ["http://localhost:5173"]
 
@@ -173,6 +235,52 @@ SIMPLE_JWT = {
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
+# Uploads are streamed to temporary files and validated as they arrive, see
+# social.uploads
+FILE_UPLOAD_HANDLERS = ["social.uploads.ImageUploadHandler"]
+IMAGE_UPLOAD_MAX_SIZE = int(os.getenv("IMAGE_UPLOAD_MAX_SIZE", 10 * 1024 * 1024))
+IMAGE_UPLOAD_MAX_PIXELS = 40_000_000
+
+# Uploads are stored once per distinct content, see social.media
+STORAGES = {
+    "default": {"BACKEND": "social.media.ContentAddressedStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+# Fan-out-on-write home timelines for the following feed. Accounts with more
+# followers than TIMELINE_FANOUT_LIMIT are merged in at read time instead.
+TIMELINE_ENABLED = os.getenv("TIMELINE_ENABLED", "False") == "True"
+TIMELINE_MAX_LENGTH = 800
+TIMELINE_FANOUT_LIMIT = 5000
+# A timeline is trimmed back to TIMELINE_MAX_LENGTH about once every this many
+# posts pushed into it, rather than on every write
+TIMELINE_TRIM_EVERY = int(os.getenv("TIMELINE_TRIM_EVERY", 50))
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": "redis://redis:6379/1",
+    },
+}
+
+# Per-viewer favorite/repost/following sets, see social.relations
+RELATIONS_CACHE_TTL = 60 * 60
+RELATIONS_CACHE_MAX_SIZE = 10000
+
+# Seconds logged-out feed and post responses are cached, see social.feed_cache.
+# 0 turns the cache off.
+FEED_CACHE_TTL = int(os.getenv("FEED_CACHE_TTL", 10))
+
+# Where notification websocket events are queued, see notification.dispatch.
+# "outbox" needs `python manage.py dispatch_notifications` running alongside.
+NOTIFICATION_DISPATCH = os.getenv("NOTIFICATION_DISPATCH", "thread")
+
+# Where uploaded images are verified and resized, see social.images.
+# "queue" needs `python manage.py process_images --watch` running alongside.
+IMAGE_PROCESSING = os.getenv("IMAGE_PROCESSING", "pool")
+# Worker processes in each server process's pool when IMAGE_PROCESSING is "pool"
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 2))
+
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
@@ -1,4 +1,48 @@
 import multiprocessing
+import os
 
 bind = "0.0.0.0:8000"
-workers = multiprocessing.cpu_count() * 2 + 1
\ No newline at end of file
+
+# "gthread", "sync", or an ASGI worker such as "uvicorn.workers.UvicornWorker"
+# (needs uvicorn installed and DB_POOL=psycopg) serving backend.asgi:application
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+
+# See DB_POOL in backend/settings.py
+db_pool = os.getenv("DB_POOL", "psycopg")
+db_pool_max_size = int(os.getenv("DB_POOL_MAX_SIZE", 8))
+# Connections all workers together may hold, below the database's
+# max_connections (100 by default on PostgreSQL) with room for other clients
+db_max_connections = int(os.getenv("DB_MAX_CONNECTIONS", 80))
+
+# Requests a gthread worker serves at once. Each thread holds a connection,
+# so with the psycopg pool there are as many threads as pooled connections.
+if worker_class == "gthread":
+    threads = int(
+        os.getenv("GUNICORN_THREADS", db_pool_max_size if db_pool == "psycopg" else 4)
+    )
+else:
+    threads = 1
+
+# An ASGI worker serves any number of requests at once, so nothing but the
+# psycopg pool bounds the connections it opens
+if worker_class not in ("gthread", "sync") and db_pool != "psycopg":
+    raise RuntimeError(
+        f"GUNICORN_WORKER_CLASS={worker_class} needs DB_POOL=psycopg to bound "
+        "the database connections of each worker"
+    )
+
+# Connections one worker holds at most
+if db_pool == "psycopg":
+    worker_connections = db_pool_max_size
+else:
+    worker_connections = threads
+
+workers = int(
+    os.getenv(
+        "GUNICORN_WORKERS",
+        min(
+            multiprocessing.cpu_count() * 2 + 1,
+            max(db_max_connections // worker_connections, 1),
+        ),
+    )
+)
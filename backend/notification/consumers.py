@@ -1,15 +1,26 @@
 import json
 import logging
+import time
 from datetime import timedelta
 
 from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
+from channels.generic.websocket import AsyncWebsocketConsumer, WebsocketConsumer
 from channels.db import database_sync_to_async
 from django.utils import timezone
 from social import models
 
 logger = logging.getLogger(__name__)
 
+STREAM_LIFETIME = timedelta(minutes=15)
+
+
+def read_message(event):
+    return {
+        "type": "notifications_read",
+        "up_to": event["up_to"],
+        "unread_count": event["unread_count"],
+    }
+
 
 class NotificationConsumer(WebsocketConsumer):
     def connect(self):
@@ -25,7 +36,7 @@ class NotificationConsumer(WebsocketConsumer):
             self.close()
             return
 
-        if self.notification_stream.created_at + timedelta(minutes=15) < timezone.now():
+        if self.notification_stream.created_at + STREAM_LIFETIME < timezone.now():
             self.close()
             return
 
@@ -41,15 +52,89 @@ class NotificationConsumer(WebsocketConsumer):
         self.notification_stream.save()
 
     def send_notification(self, event):
-        if self.notification_stream.created_at + timedelta(minutes=15) < timezone.now():
+        if self.notification_stream.created_at + STREAM_LIFETIME < timezone.now():
             self.close()
             return
         self.send(text_data=json.dumps({"message": event["message"]}))
 
     def delete_notification(self, event):
-        if self.notification_stream.created_at + timedelta(minutes=15) < timezone.now():
+        if self.notification_stream.created_at + STREAM_LIFETIME < timezone.now():
             self.close()
             return
         self.send(
             text_data=json.dumps({"type": "delete_notification", "id": event["id"]})
         )
+
+    def notifications_read(self, event):
+        if self.notification_stream.created_at + STREAM_LIFETIME < timezone.now():
+            self.close()
+            return
+        self.send(text_data=json.dumps(read_message(event)))
+
+
+class AsyncNotificationConsumer(AsyncWebsocketConsumer):
+    """
+    Same protocol as NotificationConsumer, but runs on the event loop. Sync
+    consumers share one thread for their handlers, so concurrent connects
+    queue behind each other's queries. The two lookups it needs are a single
+    async ORM query.
+    """
+
+    notification_stream = None
+
+    async def connect(self):
+        self.user_id = self.scope["url_route"]["kwargs"]["user_id"]
+        self.token = self.scope["query_string"].decode("utf-8").split("=")[1]
+        self.group_name = f"notification_{self.user_id}_{self.token}"
+        self.notification_stream = (
+            await models.NotificationStream.objects.filter(
+                account_id=self.user_id, token=self.token
+            )
+            .order_by("-created_at")
+            .afirst()
+        )
+
+        if not self.notification_stream or self.expired():
+            await self.close()
+            return
+
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if not self.notification_stream:
+            return
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        await models.NotificationStream.objects.filter(
+            id=self.notification_stream.id
+        ).aupdate(token=None)
+
+    def expired(self):
+        return self.notification_stream.created_at + STREAM_LIFETIME < timezone.now()
+
+    async def send_notification(self, event):
+        if self.expired():
+            await self.close()
+            return
+        await self.send(text_data=json.dumps({"message": event["message"]}))
+        if "queued_at" in event:
+            logger.debug(
+                "Delivered notification %s after %.1fms",
+                event["message"]["notification_id"],
+                (time.time() - event["queued_at"]) * 1000,
+            )
+
+    async def delete_notification(self, event):
+        if self.expired():
+            await self.close()
+            return
+        await self.send(
+            text_data=json.dumps({"type": "delete_notification", "id": event["id"]})
+        )
+
+    async def notifications_read(self, event):
+        if self.expired():
+            await self.close()
+            return
+        await self.send(text_data=json.dumps(read_message(event)))
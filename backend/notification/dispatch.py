@@ -0,0 +1,183 @@
+"""
+Delivery of notification events to websocket groups.
+
+The Notification signal handlers in social.models only queue an event, and
+only once their transaction commits. Delivery then happens off the request
+thread, in batches: all events of a batch share one query for the stream
+tokens and one trip through the channel layer.
+
+NOTIFICATION_DISPATCH picks where queued events go:
+    "thread": an in-process dispatcher thread (the default)
+    "outbox": NotificationOutbox rows, written in the same transaction and
+              delivered by the dispatch_notifications management command
+
+Every event carries the time it was queued, so the delay from posting to
+delivery is logged by the dispatcher and by the consumer.
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+# How long the dispatcher waits for more events before sending a batch
+LINGER = 0.005
+
+_queue = queue.Queue()
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def group_name(account_id, token):
+    # The consumer joins the group named after the account id in its URL
+    return f"notification_{account_id}_{token}"
+
+
+def notification_event(notification):
+    return {
+        "type": "send_notification",
+        "message": {
+            "action": notification.action,
+            "action_account": notification.action_account.user.username,
+            "action_account_displayname": notification.action_account.display_name,
+            "read": notification.read,
+            "created_at": (
+                notification.created_at.isoformat() if notification.created_at else None
+            ),
+            "post_id": notification.post_id,
+            "notification_id": notification.id,
+        },
+    }
+
+
+def delete_event(notification):
+    return {"type": "delete_notification", "id": notification.id}
+
+
+def read_event(up_to, unread_count):
+    """Summary sent once when notifications are marked read in bulk."""
+    return {
+        "type": "notifications_read",
+        "up_to": up_to,
+        "unread_count": unread_count,
+    }
+
+
+def enqueue(account_id, event):
+    """Queues an event for an account's stream once the transaction commits."""
+    enqueue_many([(account_id, event)])
+
+
+def enqueue_many(items):
+    """Queues (account_id, event) items with one outbox insert or commit hook."""
+    queued_at = time.time()
+    items = [
+        (account_id, {**event, "queued_at": queued_at}) for account_id, event in items
+    ]
+    if not items:
+        return
+    if settings.NOTIFICATION_DISPATCH == "outbox":
+        from social.models import NotificationOutbox
+
+        NotificationOutbox.objects.bulk_create(
+            NotificationOutbox(account_id=account_id, event=event)
+            for account_id, event in items
+        )
+        return
+
+    def put_all():
+        for item in items:
+            _queue.put(item)
+
+    transaction.on_commit(put_all)
+    start_dispatcher()
+
+
+def resolve_groups(account_ids):
+    """Maps each account with an open stream to its websocket group."""
+    from social.models import NotificationStream
+
+    groups = {}
+    streams = NotificationStream.objects.filter(
+        account_id__in=account_ids, token__isnull=False
+    ).order_by("-id")
+    for account_id, token in streams.values_list("account_id", "token"):
+        groups.setdefault(account_id, group_name(account_id, token))
+    return groups
+
+
+def send_batch(items):
+    """
+    Delivers (account_id, event) items. Events for accounts without an open
+    stream are dropped. Returns the number of events sent.
+    """
+    groups = resolve_groups({account_id for account_id, _ in items})
+    messages = [
+        (groups[account_id], event)
+        for account_id, event in items
+        if account_id in groups
+    ]
+    if not messages:
+        return 0
+
+    channel_layer = get_channel_layer()
+
+    async def send_all():
+        await asyncio.gather(
+            *(channel_layer.group_send(group, event) for group, event in messages)
+        )
+
+    async_to_sync(send_all)()
+    delays = [time.time() - event["queued_at"] for _, event in messages]
+    logger.debug(
+        "Dispatched %d notification events, delay max %.1fms avg %.1fms",
+        len(messages),
+        max(delays) * 1000,
+        sum(delays) / len(delays) * 1000,
+    )
+    return len(messages)
+
+
+def start_dispatcher():
+    global _dispatcher
+    if _dispatcher is not None and _dispatcher.is_alive():
+        return
+    with _dispatcher_lock:
+        if _dispatcher is None or not _dispatcher.is_alive():
+            _dispatcher = threading.Thread(
+                target=run_dispatcher, name="notification-dispatch", daemon=True
+            )
+            _dispatcher.start()
+
+
+def run_dispatcher():
+    while True:
+        batch = [_queue.get()]
+        deadline = time.monotonic() + LINGER
+        while len(batch) < BATCH_SIZE:
+            try:
+                batch.append(_queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        try:
+            send_batch(batch)
+        except Exception:
+            logger.exception("Failed to dispatch %d notification events", len(batch))
+        finally:
+            close_old_connections()
+            for _ in batch:
+                _queue.task_done()
+
+
+def flush():
+    """Blocks until every event queued in this process has been dispatched."""
+    _queue.join()
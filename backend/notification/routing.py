@@ -4,6 +4,7 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(
-        r"ws/notification/(?P<user_id>\w+)/$", consumers.NotificationConsumer.as_asgi()
+        r"ws/notification/(?P<user_id>\w+)/$",
+        consumers.AsyncNotificationConsumer.as_asgi(),
     ),
 ]
@@ -10,6 +10,9 @@ from .models import (
     ImagePost,
     Notification,
     NotificationStream,
+    NotificationOutbox,
+    TimelineEntry,
+    MediaBlob,
 )
 
 admin.site.register(Account)
@@ -22,3 +25,6 @@ admin.site.register(MarkdownPost)
 admin.site.register(ImagePost)
 admin.site.register(Notification)
 admin.site.register(NotificationStream)
+admin.site.register(NotificationOutbox)
+admin.site.register(TimelineEntry)
+admin.site.register(MediaBlob)
@@ -0,0 +1,131 @@
+"""
+Conditional GET for responses the frontend fetches again and again.
+
+A validator reads the version stamps (see social.versions) of everything a
+response is built from, which takes a cache round trip and at most a small
+query. From them it derives an ETag and a Last-Modified, so an unchanged
+response is answered with 304 Not Modified before anything is serialized.
+Responses are marked private and no-cache, so browsers keep them and revalidate
+every time.
+"""
+
+import functools
+import hashlib
+
+from django.core.cache import cache
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.http import http_date, quote_etag
+from social import models, threads, versions
+from social.pagination import PAGE_SIZE, Cursor, InvalidCursor, ordering
+
+# A post's reply_to chain and repost original never change, so neither does
+# the set of posts its response is built from
+MEMBERS_TTL = 60 * 60 * 24
+
+
+def conditional(validator):
+    """
+    Decorates a view method with conditional GET. `validator(request)`
+    returns ({scope: stamp}, other parts of the ETag), or None to serve the
+    request unconditionally. The method finds the ETag in `request.etag`, so
+    whatever it caches can follow the same versions.
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            validated = validator(request)
+            request.etag = None
+            if validated is None:
+                return method(self, request, *args, **kwargs)
+            stamps, parts = validated
+            digest = hashlib.md5(repr((sorted(stamps.items()), parts)).encode())
+            etag = request.etag = quote_etag(digest.hexdigest())
+            last_modified = max(stamps.values()) // 1_000_000_000 if stamps else None
+
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified
+            )
+            if response is None:
+                response = method(self, request, *args, **kwargs)
+                if response.status_code == 200:
+                    response["ETag"] = etag
+                    if last_modified:
+                        response["Last-Modified"] = http_date(last_modified)
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ["Authorization"])
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def viewer_id(request):
+    return request.user.id if request.user.is_authenticated else None
+
+
+def post_members(post_id):
+    """
+    (post id, author username) of a post and of every post nested in its
+    response, following reply_to and repost originals.
+    """
+    key = f"post-members:{post_id}"
+    members = cache.get(key)
+    if members is not None:
+        return members
+    ids = {id for id, _, _ in threads.chain_rows([post_id])}
+    members = list(
+        models.Post.objects.filter(id__in=ids).values_list(
+            "id", "account__user__username"
+        )
+    )
+    if members:
+        cache.set(key, members, MEMBERS_TTL)
+    return members
+
+
+def post_validator(request):
+    post_id = request.GET.get("id")
+    if not post_id:
+        return None
+    members = post_members(int(post_id))
+    if not members:
+        return None
+    scopes = {versions.post_scope(id) for id, _ in members}
+    scopes |= {versions.profile_scope(username) for _, username in members}
+    return versions.get_many(scopes), viewer_id(request)
+
+
+def profile_info_validator(request):
+    username = request.GET.get("username")
+    if not username:
+        return None
+    scopes = [versions.profile_scope(username)]
+    return versions.get_many(scopes), (username, viewer_id(request))
+
+
+def notifications_validator(request):
+    if not request.user.is_authenticated:
+        return None
+    try:
+        cursor = Cursor.from_request(request)
+    except InvalidCursor:
+        return None
+    account_id = models.Account.objects.values_list("id", flat=True).get(
+        user=request.user
+    )
+    # Display names on the page, without loading the page itself
+    usernames = set(
+        models.visible_notifications(account_id)
+        .filter(cursor.filter())
+        .order_by(*ordering())
+        .values_list("action_account__user__username", flat=True)[: PAGE_SIZE + 1]
+    )
+    scopes = {versions.notifications_scope(account_id)}
+    scopes |= {versions.profile_scope(username) for username in usernames}
+    return versions.get_many(scopes), request.GET.urlencode()
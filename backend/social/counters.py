@@ -0,0 +1,34 @@
+"""
+Recounts of the denormalized counters, as subquery expressions for UPDATEs.
+Shared by rebuild_post_counters and the seeding.
+"""
+
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from social.models import Favorite, Post, Repost
+
+POST_COUNTERS = ("favorite_count", "repost_count", "reply_count")
+
+
+def count_subquery(queryset, field):
+    """The number of `queryset` rows whose `field` points at the outer row."""
+    counts = (
+        queryset.filter(**{field: OuterRef("pk")})
+        .order_by()
+        .values(field)
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def actual_counts():
+    """{counter: its recount} for every counter in POST_COUNTERS."""
+    return {
+        "favorite_count": count_subquery(Favorite.objects, "post"),
+        # A hidden repost is uncounted before the reaper removes its row
+        "repost_count": count_subquery(
+            Repost.objects.filter(post__deleted_at__isnull=True), "original_post"
+        ),
+        "reply_count": count_subquery(Post.objects, "reply_to"),
+    }
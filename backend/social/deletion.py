@@ -0,0 +1,176 @@
+"""
+Two-step post deletion.
+
+Deleting a post used to run Django's delete collector over its whole reply
+tree inside the request. That fired a websocket event for every notification
+and removed image files one by one. Now soft_delete only stamps deleted_at on
+the post, every reply below it and the reposts of any of them, in one UPDATE.
+Post.objects leaves such rows out, so they disappear from every read at once.
+Notifications about them are marked read, so unread counts and notification
+ETags change with them.
+
+The reap_deleted_posts command removes the rows later. It takes them in
+batches, replies before the posts they reply to, and issues one DELETE per
+table per batch. The batch's websocket events are queued together and its
+files are released together.
+"""
+
+from collections import Counter
+
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from notification import dispatch
+from social import models, versions
+
+BATCH_SIZE = 500
+
+
+def soft_delete(post):
+    """
+    Hides a post, all of its replies however deep, and the reposts of any of
+    them.
+    """
+    posts = connection.ops.quote_name(models.Post._meta.db_table)
+    reposts = connection.ops.quote_name(models.Repost._meta.db_table)
+    sql = f"""
+        WITH RECURSIVE subtree(id) AS (
+            SELECT id FROM {posts} WHERE id = %s
+            UNION ALL
+            SELECT e.child FROM (
+                SELECT id AS child, reply_to_id AS parent FROM {posts}
+                WHERE deleted_at IS NULL
+                UNION ALL
+                SELECT post_id, original_post_id FROM {reposts}
+                WHERE post_id IS NOT NULL
+            ) e JOIN subtree s ON e.parent = s.id
+        )
+        UPDATE {posts} SET deleted_at = %s
+        WHERE id IN (SELECT id FROM subtree) AND deleted_at IS NULL
+    """
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [post.id, connection.ops.adapt_datetimefield_value(now)])
+
+    hidden = models.Post.all_objects.filter(deleted_at=now)
+    hide_notifications(hidden)
+    # A repost that replied to a post still shown no longer counts as a reply
+    for reply_to_id in (
+        hidden.exclude(id=post.id)
+        .filter(repost_post__isnull=False, reply_to__deleted_at__isnull=True)
+        .values_list("reply_to_id", flat=True)
+    ):
+        models.adjust_post_counter(reply_to_id, "reply_count", -1)
+    uncount_reposts(hidden)
+
+
+def uncount_reposts(posts):
+    """Takes hidden repost `posts` off the repost_count of originals still shown."""
+    for original_id in models.Repost.objects.filter(
+        post__in=posts, original_post__deleted_at__isnull=True
+    ).values_list("original_post_id", flat=True):
+        models.adjust_post_counter(original_id, "repost_count", -1)
+
+
+def hide_notifications(posts):
+    """
+    Marks the notifications about hidden `posts` read, takes them off the
+    unread counts and bumps the notification versions of their accounts.
+    """
+    notifications = models.Notification.objects.filter(post__in=posts)
+    found = list(notifications.values_list("account_id", "read"))
+    if not found:
+        return
+    notifications.filter(read=False).update(read=True)
+    unread = Counter(account_id for account_id, read in found if not read)
+    for account_id, count in unread.items():
+        models.adjust_unread_count(account_id, -count)
+    account_ids = {account_id for account_id, _ in found}
+    versions.bump(*(versions.notifications_scope(id) for id in account_ids))
+
+
+def hide_orphans():
+    """
+    Hides replies and reposts that were written while the post they point to
+    was being deleted. Only the children of posts waiting to be reaped are
+    looked at, which post_deleted_idx lists without reading the whole table.
+    """
+    deleted = models.Post.all_objects.filter(deleted_at__isnull=False).values("id")
+    if not deleted.exists():
+        return 0
+    now = timezone.now()
+    hidden = models.Post.objects.filter(reply_to__in=deleted).update(deleted_at=now)
+    wrappers = models.Repost.objects.filter(original_post__in=deleted)
+    hidden += models.Post.objects.filter(id__in=wrappers.values("post_id")).update(
+        deleted_at=now
+    )
+    if hidden:
+        hidden_posts = models.Post.all_objects.filter(deleted_at=now)
+        hide_notifications(hidden_posts)
+        uncount_reposts(hidden_posts)
+    return hidden
+
+
+def reapable():
+    # A post goes once nothing replies to it any more, so replies go first
+    return models.Post.all_objects.filter(deleted_at__isnull=False).filter(
+        ~Exists(models.Post.all_objects.filter(reply_to=OuterRef("pk")))
+    )
+
+
+def raw_delete(queryset):
+    """One DELETE statement, without signals or the cascade collector."""
+    return queryset._raw_delete(queryset.db)
+
+
+@transaction.atomic
+def reap_batch(batch_size=BATCH_SIZE):
+    """Removes up to batch_size soft-deleted posts. Returns how many."""
+    hide_orphans()
+    ids = list(
+        reapable()
+        .select_for_update(skip_locked=True)
+        .order_by("id")
+        .values_list("id", flat=True)[:batch_size]
+    )
+    if not ids:
+        return 0
+
+    notifications = list(
+        models.Notification.objects.filter(post_id__in=ids).only(
+            "id", "account_id", "read"
+        )
+    )
+    files = []
+    for image, variants in models.ImagePost.objects.filter(post_id__in=ids).values_list(
+        "image", "variants"
+    ):
+        files.append(image)
+        files.extend((variants or {}).values())
+
+    raw_delete(models.Notification.objects.filter(post_id__in=ids))
+    raw_delete(models.TimelineEntry.objects.filter(post_id__in=ids))
+    raw_delete(models.Favorite.objects.filter(post_id__in=ids))
+    raw_delete(models.Repost.objects.filter(post_id__in=ids))
+    raw_delete(models.Repost.objects.filter(original_post_id__in=ids))
+    raw_delete(models.TextPost.objects.filter(post_id__in=ids))
+    raw_delete(models.MarkdownPost.objects.filter(post_id__in=ids))
+    raw_delete(models.ImagePost.objects.filter(post_id__in=ids))
+    raw_delete(models.Post.all_objects.filter(id__in=ids))
+
+    # What the Notification and ImagePost delete signals would have done, once
+    # per account. Files are released once per reference, as blobs are shared.
+    unread = Counter(n.account_id for n in notifications if not n.read)
+    for account_id, count in unread.items():
+        models.adjust_unread_count(account_id, -count)
+    dispatch.enqueue_many(
+        [(n.account_id, dispatch.delete_event(n)) for n in notifications]
+    )
+    account_ids = {n.account_id for n in notifications}
+    if account_ids:
+        versions.bump(*(versions.notifications_scope(id) for id in account_ids))
+    for name in files:
+        if name:
+            default_storage.delete(name)
+    return len(ids)
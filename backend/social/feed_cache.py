@@ -0,0 +1,82 @@
+"""
+Shared cache of the responses logged-out viewers get from Post.get.
+
+Without a viewer there are no favorited/reposted/is_owner flags, so the global
+feed depends only on the page cursor and a single post only on its id. Those
+are cached for FEED_CACHE_TTL seconds under keys carrying a version. Creating
+or deleting a post, finishing an image and changing a profile move the
+version on, which orphans every cached entry at once. Counters in the feed
+are allowed to lag by up to the TTL. A single post is also keyed by its ETag
+(see social.conditional), so a favorite or repost moves it on as well.
+
+When an entry is missing, one request recomputes it while the others wait
+for its result (single flight), so a burst of traffic on a cold key runs the
+queries once.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = "feed-cache:version"
+# Longest a recomputation may hold the lock
+LOCK_TTL = 10
+# How long waiters poll for the result before computing it themselves
+LOCK_WAIT = 2
+POLL_INTERVAL = 0.02
+
+
+def enabled():
+    return settings.FEED_CACHE_TTL > 0
+
+
+def version():
+    current = cache.get(VERSION_KEY)
+    if current is None:
+        # A clock reading never repeats an evicted version's entries
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        current = cache.get(VERSION_KEY)
+    return current
+
+
+def invalidate():
+    """Moves every entry out of reach once the current transaction commits."""
+    transaction.on_commit(lambda: cache.set(VERSION_KEY, time.time_ns(), None))
+
+
+def feed_key(cursor):
+    created_at = cursor.created_at.isoformat() if cursor.created_at else ""
+    until = cursor.until.isoformat() if cursor.until else ""
+    return f"feed:{created_at}|{cursor.pk}|{until}"
+
+
+def post_key(post_id, etag):
+    return f"post:{post_id}:{etag}"
+
+
+def get_or_compute(key, compute):
+    """Cached value of `key`, computed by only one caller at a time."""
+    key = f"feed-cache:{version()}:{key}"
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock_key = f"{key}:lock"
+    if not cache.add(lock_key, 1, LOCK_TTL):
+        deadline = time.monotonic() + LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            value = cache.get(key)
+            if value is not None:
+                return value
+        # The holder is too slow or gone, so stop waiting on it
+        return compute()
+
+    try:
+        value = compute()
+        cache.set(key, value, settings.FEED_CACHE_TTL)
+        return value
+    finally:
+        cache.delete(lock_key)
@@ -0,0 +1,256 @@
+"""
+Derived image variants for uploads.
+
+Originals are kept as uploaded, but clients are served bounded-size WebP
+re-encodes of them. Re-encoding drops EXIF and other metadata (after applying
+the EXIF orientation). An image is not served at all until its variants
+exist, so location data in the originals is never served. Uploads made
+before variants existed are served once `process_images` has rendered them.
+Variant storage names are recorded on the model as {variant: name}.
+
+Verifying an upload and rendering its variants is CPU bound, so it is kept
+out of the request: render_job runs in a pool of worker processes once the
+upload's transaction commits. IMAGE_PROCESSING picks where that happens:
+    "pool": a process pool owned by the server process (the default)
+    "queue": uploads stay pending for the `process_images --watch` worker
+    "inline": in the request itself, for development
+Image posts carry their progress in ImagePost.state, account pictures in
+Account.profile_picture_state and banner_picture_state. Jobs still queued in a
+pool when its server stops are lost, and `process_images` picks up the image
+posts they leave pending.
+"""
+
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from social import feed_cache, versions
+from PIL import Image as PILImage, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Variant name -> longest side in pixels
+VARIANT_SIZES = {
+    "avatar": 256,
+    "feed": 1080,
+    "full": 2048,
+}
+POST_VARIANTS = ("feed", "full")
+PROFILE_PICTURE_VARIANTS = ("avatar",)
+BANNER_VARIANTS = ("feed",)
+
+FORMAT = "WEBP"
+QUALITY = 80
+
+# ImagePost.state values
+PENDING = "pending"
+PROCESSING = "processing"
+READY = "ready"
+FAILED = "failed"
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class InvalidImage(Exception):
+    pass
+
+
+def render_variants(file, names):
+    """Returns {variant: WebP bytes} for the image read from `file`."""
+    with PILImage.open(file) as img:
+        img = ImageOps.exif_transpose(img)
+        # Keeps the alpha of LA images and of palette or RGB images with a
+        # transparent color
+        if img.has_transparency_data:
+            if img.mode != "RGBA":
+                img = img.convert("RGBA")
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+        rendered = {}
+        for name in names:
+            size = VARIANT_SIZES[name]
+            variant = img.copy()
+            variant.thumbnail((size, size), PILImage.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            variant.save(buffer, FORMAT, quality=QUALITY, method=4)
+            rendered[name] = buffer.getvalue()
+        return rendered
+
+
+def render_job(path, names):
+    """
+    Verifies the image at `path` and renders its variants. Runs in a worker
+    process, so it only takes and returns plain values.
+    """
+    try:
+        with PILImage.open(path) as img:
+            img.verify()
+    except (IOError, SyntaxError) as e:
+        raise InvalidImage(path) from e
+    return render_variants(path, names)
+
+
+def store_variants(original_name, rendered):
+    """Saves rendered variants next to the original, returning their names."""
+    base = os.path.splitext(original_name)[0]
+    return {
+        name: default_storage.save(f"{base}.{name}.webp", ContentFile(data))
+        for name, data in rendered.items()
+    }
+
+
+def delete_variants(variants):
+    for name in (variants or {}).values():
+        try:
+            default_storage.delete(name)
+        except OSError:
+            logger.warning("Could not delete image variant %s", name)
+
+
+def variant_url(variants, preferred):
+    """
+    URL of the first available preferred variant, else None. Never the
+    original's, which may carry metadata.
+    """
+    for name in preferred:
+        if name in (variants or {}):
+            return default_storage.url(variants[name])
+    return None
+
+
+def account_variant_names(field):
+    if field == "profile_picture":
+        return PROFILE_PICTURE_VARIANTS
+    return BANNER_VARIANTS
+
+
+def finish_image_post(image_post_id, result):
+    """
+    Records the outcome of an image post's render_job. `result` returns the
+    rendered variants or raises what the job raised.
+    """
+    from social.models import ImagePost
+
+    image_post = ImagePost.objects.filter(id=image_post_id).first()
+    if image_post is None:
+        return
+    try:
+        rendered = result()
+    except Exception:
+        logger.exception("Could not process image post %s", image_post_id)
+        image_post.state = FAILED
+        image_post.save(update_fields=["state"])
+        feed_cache.invalidate()
+        versions.bump(versions.post_scope(image_post.post_id))
+        return
+    image_post.variants = store_variants(image_post.image.name, rendered)
+    image_post.state = READY
+    image_post.save(update_fields=["variants", "state"])
+    feed_cache.invalidate()
+    versions.bump(versions.post_scope(image_post.post_id))
+
+
+def finish_account_picture(account_id, field, name, result):
+    """
+    Records the outcome of an account picture's render_job. `name` is the
+    file the job rendered, so a job for a picture that was replaced since
+    changes nothing.
+    """
+    from social.models import Account
+
+    account = Account.objects.select_related("user").filter(id=account_id).first()
+    if account is None or getattr(account, field).name != name:
+        return
+    # Conditional, as another upload may replace the picture while this runs
+    current = Account.objects.filter(id=account_id, **{field: name})
+    try:
+        rendered = result()
+    except Exception:
+        # Never verified, so it is dropped rather than served as uploaded
+        logger.exception("Could not process %s of account %s", field, account_id)
+        if current.update(**{field: None, f"{field}_state": FAILED}):
+            getattr(account, field).storage.delete(name)
+    else:
+        variants = store_variants(name, rendered)
+        if not current.update(
+            **{f"{field}_variants": variants, f"{field}_state": READY}
+        ):
+            delete_variants(variants)
+            return
+    feed_cache.invalidate()
+    versions.bump(versions.profile_scope(account.user.username))
+
+
+def image_post_job(image_post):
+    return (image_post.image.path, POST_VARIANTS)
+
+
+def account_picture_job(account, field):
+    return (getattr(account, field).path, account_variant_names(field))
+
+
+def create_executor(workers):
+    # spawn, as forking a process that holds database connections and
+    # threads is not safe
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = create_executor(settings.IMAGE_WORKERS)
+        return _executor
+
+
+def run_in_pool(executor, job, finish):
+    """Runs render_job in `executor` and hands its outcome to `finish`."""
+
+    def done(future):
+        try:
+            finish(future.result)
+        except Exception:
+            logger.exception("Could not store processed image %s", job[0])
+        finally:
+            close_old_connections()
+
+    future = executor.submit(render_job, *job)
+    future.add_done_callback(done)
+    return future
+
+
+def submit(job, finish):
+    if settings.IMAGE_PROCESSING == "inline":
+        finish(lambda: render_job(*job))
+    elif settings.IMAGE_PROCESSING == "pool":
+        run_in_pool(get_executor(), job, finish)
+
+
+def process_image_post(image_post):
+    """Hands a new image post to the workers once the transaction commits."""
+    job = image_post_job(image_post)
+    transaction.on_commit(
+        lambda: submit(job, lambda result: finish_image_post(image_post.id, result))
+    )
+
+
+def process_account_picture(account, field):
+    """Same for an account's new profile_picture or banner_picture."""
+    job = account_picture_job(account, field)
+    name = getattr(account, field).name
+    transaction.on_commit(
+        lambda: submit(
+            job,
+            lambda result: finish_account_picture(account.id, field, name, result),
+        )
+    )
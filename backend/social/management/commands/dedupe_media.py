@@ -0,0 +1,95 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from social import media
+from social.models import Account, ImagePost, MediaBlob
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves media stored under upload names into content-addressed blobs, "
+        "storing identical files once"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report how much space would be saved",
+        )
+
+    def handle(self, *args, **options):
+        self.dry_run = options["dry_run"]
+        self.moved = 0
+        self.legacy_bytes = 0
+        self.stored_bytes = 0
+        # Blobs that exist, or would in a dry run
+        self.seen = set(MediaBlob.objects.values_list("name", flat=True))
+        self.errors = []
+
+        for image_post in ImagePost.objects.iterator():
+            with transaction.atomic():
+                image_post.image.name = self.move(image_post.image.name)
+                image_post.variants = self.move_variants(image_post.variants)
+                if not self.dry_run:
+                    image_post.save(update_fields=["image", "variants"])
+
+        for account in Account.objects.iterator():
+            fields = []
+            with transaction.atomic():
+                for field in ("profile_picture", "banner_picture"):
+                    if not getattr(account, field):
+                        continue
+                    getattr(account, field).name = self.move(
+                        getattr(account, field).name
+                    )
+                    setattr(
+                        account,
+                        f"{field}_variants",
+                        self.move_variants(getattr(account, f"{field}_variants")),
+                    )
+                    fields += [field, f"{field}_variants"]
+                if fields and not self.dry_run:
+                    # save() would treat the renamed pictures as replaced ones
+                    Account.objects.filter(id=account.id).update(
+                        **{field: getattr(account, field) for field in fields}
+                    )
+
+        saved = self.legacy_bytes - self.stored_bytes
+        verb = "Would move" if self.dry_run else "Moved"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{verb} {self.moved} files: {self.legacy_bytes} bytes stored as "
+                f"{self.stored_bytes} bytes, {saved} bytes saved"
+            )
+        )
+        if self.errors:
+            self.stdout.write(self.style.WARNING("Errors:"))
+            for error in self.errors:
+                self.stdout.write(self.style.ERROR(error))
+
+    def move_variants(self, variants):
+        return {variant: self.move(name) for variant, name in variants.items()}
+
+    def move(self, name):
+        """Returns the blob name for a legacy file, storing it if needed."""
+        if not name or media.is_blob(name):
+            return name
+        try:
+            with default_storage.open(name) as file:
+                size = file.size
+                blob = media.blob_name(media.content_hash(file), name)
+                if blob not in self.seen:
+                    self.stored_bytes += size
+                    self.seen.add(blob)
+                if not self.dry_run:
+                    blob = default_storage.save(name, file)
+        except OSError as e:
+            self.errors.append(f"Error moving {name}: {e}")
+            return name
+
+        self.moved += 1
+        self.legacy_bytes += size
+        if not self.dry_run:
+            transaction.on_commit(lambda: default_storage.delete(name))
+        return blob
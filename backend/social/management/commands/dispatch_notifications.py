@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from notification import dispatch
+from social.models import NotificationOutbox
+
+
+class Command(BaseCommand):
+    help = "Delivers queued NotificationOutbox events to websocket groups"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=dispatch.BATCH_SIZE,
+            help="Number of events to deliver per batch",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=0.1,
+            help="Seconds to sleep when the outbox is empty",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Drain the outbox once and exit",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            sent = self.dispatch_batch(options["batch_size"])
+            close_old_connections()
+            if not sent:
+                if options["once"]:
+                    return
+                time.sleep(options["poll_interval"])
+
+    def dispatch_batch(self, batch_size):
+        with transaction.atomic():
+            # skip_locked lets several workers drain the outbox side by side
+            pending = NotificationOutbox.objects.select_for_update(skip_locked=True)
+            rows = list(pending.order_by("id")[:batch_size])
+            if not rows:
+                return 0
+            delivered = dispatch.send_batch(
+                [(row.account_id, row.event) for row in rows]
+            )
+            NotificationOutbox.objects.filter(id__in=[row.id for row in rows]).delete()
+
+        oldest = (timezone.now() - rows[0].created_at).total_seconds() * 1000
+        self.stdout.write(
+            f"Delivered {delivered}/{len(rows)} events, "
+            f"oldest queued {oldest:.1f}ms ago"
+        )
+        return len(rows)
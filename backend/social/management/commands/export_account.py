@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from social import export
+from social.models import Account
+from social.pagination import InvalidCursor
+
+
+class Command(BaseCommand):
+    help = "Exports an account's posts, relations and notifications as NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("username")
+        parser.add_argument(
+            "--output",
+            default="-",
+            help="File to write to, standard output by default",
+        )
+        parser.add_argument(
+            "--cursor",
+            help="Resume after the line carrying this cursor, appending to --output",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=export.CHUNK_SIZE,
+            help="Number of rows fetched from the database at a time",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            account = Account.objects.get(user__username=options["username"])
+        except Account.DoesNotExist:
+            raise CommandError(f"No account named {options['username']}")
+        cursor = options["cursor"]
+        if cursor:
+            try:
+                export.decode_cursor(cursor)
+            except InvalidCursor:
+                raise CommandError(f"Invalid cursor {cursor}")
+
+        started = time.monotonic()
+        written = 0
+        blocks = export.lines(account, cursor, options["chunk_size"])
+        if options["output"] == "-":
+            for block in blocks:
+                self.stdout.write(block.decode(), ending="")
+            return
+        with open(options["output"], "ab" if cursor else "wb") as output:
+            for block in blocks:
+                output.write(block)
+                written += block.count(b"\n")
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Exported {written} rows to {options['output']} in {elapsed:.1f}s "
+                f"({written / max(elapsed, 1e-9):.0f} rows/s)"
+            )
+        )
@@ -0,0 +1,314 @@
+import asyncio
+import io
+import json
+import secrets
+import time
+
+from asgiref.sync import async_to_sync, sync_to_async
+from backend.asgi import application
+from channels.layers import channel_layers
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from social import deletion, models, versions
+from social.stats import percentile
+
+# Ids per statement when cleaning up
+REMOVE_BATCH_SIZE = 1000
+
+LAYERS = {
+    "memory": lambda options: {"BACKEND": "channels.layers.InMemoryChannelLayer"},
+    "redis": lambda options: {
+        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "CONFIG": {"hosts": [options["redis_url"]]},
+    },
+}
+
+
+def summary(samples):
+    """p50, p99 and max of a list of seconds, in milliseconds."""
+    if not samples:
+        return {"p50_ms": None, "p99_ms": None, "max_ms": None}
+    return {
+        "p50_ms": round(percentile(samples, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 2),
+        "max_ms": round(max(samples) * 1000, 2),
+    }
+
+
+def origin():
+    """An Origin header AllowedHostsOriginValidator lets through."""
+    hosts = [host for host in settings.ALLOWED_HOSTS if host != "*"]
+    return f"http://{hosts[0].lstrip('.') if hosts else 'localhost'}".encode()
+
+
+class Command(BaseCommand):
+    help = (
+        "Opens many notification websockets in this process, sends them "
+        "notifications and measures connects and delivery through the channel layer"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--connections",
+            type=int,
+            default=1000,
+            help="Websockets to open, one per account",
+        )
+        parser.add_argument(
+            "--rounds",
+            type=int,
+            default=5,
+            help="Times every connected account is notified",
+        )
+        parser.add_argument(
+            "--layer",
+            choices=["settings", *LAYERS],
+            default="settings",
+            help="Channel layer to use, CHANNEL_LAYERS by default",
+        )
+        parser.add_argument(
+            "--redis-url",
+            default="redis://localhost:6379",
+            help="Redis server of --layer redis",
+        )
+        parser.add_argument(
+            "--dispatch",
+            choices=["thread", "outbox"],
+            help="NOTIFICATION_DISPATCH to use. With outbox, the outbox is drained "
+            "after each round, as dispatch_notifications would",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=100,
+            help="Handshakes in flight at once",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=30.0,
+            help="Seconds to wait for a handshake or for a round to be delivered",
+        )
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+        parser.add_argument(
+            "--keep",
+            action="store_true",
+            help="Leave the notifications sent in the database",
+        )
+
+    def handle(self, *args, **options):
+        if options["layer"] != "settings":
+            settings.CHANNEL_LAYERS = {"default": LAYERS[options["layer"]](options)}
+            channel_layers.backends = {}
+        if options["dispatch"]:
+            settings.NOTIFICATION_DISPATCH = options["dispatch"]
+        backend = settings.CHANNEL_LAYERS["default"]["BACKEND"]
+        if backend.endswith("InMemoryChannelLayer") and (
+            settings.NOTIFICATION_DISPATCH == "thread"
+        ):
+            # The dispatcher thread sends from an event loop of its own, which
+            # the in-memory layer cannot wake the consumers' loop from
+            raise CommandError(
+                "The in-memory channel layer only works with --dispatch outbox"
+            )
+
+        connections = options["connections"]
+        ids = list(
+            models.Account.objects.order_by("id").values_list("id", flat=True)[
+                : connections + 1
+            ]
+        )
+        if len(ids) <= connections:
+            raise CommandError(
+                f"Needs {connections + 1} accounts but there are {len(ids)}, "
+                "create more with seed_data"
+            )
+        actor = models.Account.objects.select_related("user").get(id=ids[0])
+        tokens = self.issue_tokens(ids[1:])
+
+        started = time.monotonic()
+        results, sent, notified = async_to_sync(self.run)(actor, tokens, options)
+        results["layer"] = backend
+        results["dispatch"] = settings.NOTIFICATION_DISPATCH
+        results["seconds"] = round(time.monotonic() - started, 2)
+        if not options["keep"]:
+            self.remove(sent, notified, options["rounds"])
+
+        connect = results["connect"]
+        delivery = results["delivery"]
+        self.stdout.write(
+            f"connect: {connect['connected']}/{connections} in "
+            f"{connect['seconds']:.2f}s ({connect['per_second']:.0f}/s), "
+            f"p50 {connect['p50_ms']}ms p99 {connect['p99_ms']}ms"
+        )
+        self.stdout.write(
+            f"delivery: {delivery['delivered']}/{delivery['expected']} messages "
+            f"({delivery['per_second']:.0f}/s), p50 {delivery['p50_ms']}ms "
+            f"p99 {delivery['p99_ms']}ms max {delivery['max_ms']}ms"
+        )
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+        style = self.style.SUCCESS
+        if delivery["delivered"] < delivery["expected"]:
+            style = self.style.WARNING
+        self.stdout.write(
+            style(
+                f"Ran {options['rounds']} rounds over {connect['connected']} "
+                f"websockets on {backend} in {results['seconds']:.1f}s"
+            )
+        )
+
+    def issue_tokens(self, account_ids):
+        """A fresh stream token per account, as NotificationToken hands out."""
+        now = timezone.now()
+        streams = {
+            stream.account_id: stream
+            for stream in models.NotificationStream.objects.filter(
+                account_id__in=account_ids
+            ).order_by("id")
+        }
+        missing = [
+            models.NotificationStream(account_id=account_id)
+            for account_id in account_ids
+            if account_id not in streams
+        ]
+        for stream in models.NotificationStream.objects.bulk_create(missing):
+            streams[stream.account_id] = stream
+        for stream in streams.values():
+            stream.token = secrets.token_urlsafe(32)
+            stream.created_at = now
+        models.NotificationStream.objects.bulk_update(
+            streams.values(), ["token", "created_at"], batch_size=1000
+        )
+        return {account_id: streams[account_id].token for account_id in account_ids}
+
+    async def run(self, actor, tokens, options):
+        semaphore = asyncio.Semaphore(options["concurrency"])
+        timeout = options["timeout"]
+        headers = [(b"origin", origin())]
+        connect_times = []
+
+        async def connect(account_id, token):
+            communicator = WebsocketCommunicator(
+                application,
+                f"/ws/notification/{account_id}/?token={token}",
+                headers=headers,
+            )
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    connected, _ = await communicator.connect(timeout=timeout)
+                except asyncio.TimeoutError:
+                    connected = False
+                connect_times.append(time.perf_counter() - started)
+            return (account_id, communicator) if connected else None
+
+        started = time.perf_counter()
+        opened = await asyncio.gather(
+            *(connect(account_id, token) for account_id, token in tokens.items())
+        )
+        connect_seconds = time.perf_counter() - started
+        sockets = dict(socket for socket in opened if socket)
+
+        received = []
+
+        async def receive(communicator):
+            while True:
+                message = json.loads(await communicator.receive_from(timeout=3600))
+                if "message" in message:
+                    received.append(
+                        (time.time(), message["message"]["notification_id"])
+                    )
+
+        receivers = [
+            asyncio.create_task(receive(communicator))
+            for communicator in sockets.values()
+        ]
+
+        sent = {}
+        latencies = []
+        delivery_seconds = 0.0
+        for _ in range(options["rounds"] if sockets else 0):
+            first = len(received)
+            ids, committed = await sync_to_async(self.notify)(actor, list(sockets))
+            sent.update(dict.fromkeys(ids, committed))
+            if settings.NOTIFICATION_DISPATCH == "outbox":
+                await sync_to_async(call_command)(
+                    "dispatch_notifications", once=True, stdout=io.StringIO()
+                )
+            deadline = time.monotonic() + timeout
+            while len(received) - first < len(ids) and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+            arrivals = received[first:]
+            latencies += [at - sent[id] for at, id in arrivals if id in sent]
+            if arrivals:
+                delivery_seconds += max(at for at, _ in arrivals) - committed
+
+        for task in receivers:
+            task.cancel()
+        await asyncio.gather(*receivers, return_exceptions=True)
+
+        async def disconnect(communicator):
+            async with semaphore:
+                await communicator.disconnect()
+
+        await asyncio.gather(*(disconnect(c) for c in sockets.values()))
+
+        results = {
+            "connect": {
+                "connected": len(sockets),
+                "seconds": round(connect_seconds, 3),
+                "per_second": len(sockets) / connect_seconds if connect_seconds else 0,
+                **summary(connect_times),
+            },
+            "delivery": {
+                "expected": len(sent),
+                "delivered": len(latencies),
+                "per_second": (
+                    len(latencies) / delivery_seconds if delivery_seconds else 0
+                ),
+                **summary(latencies),
+            },
+        }
+        return results, list(sent), list(sockets)
+
+    def notify(self, actor, account_ids):
+        """
+        Notifies every account in one transaction, through the model signals.
+        Returns the new notification ids and when the transaction committed.
+        """
+        committed = []
+        with transaction.atomic():
+            # Registered first, so it runs before the dispatch hooks
+            transaction.on_commit(lambda: committed.append(time.time()))
+            ids = [
+                models.Notification.objects.create(
+                    account_id=account_id, action_account=actor, action="followed"
+                ).id
+                for account_id in account_ids
+            ]
+        return ids, committed[0]
+
+    def remove(self, notification_ids, account_ids, rounds):
+        """
+        Deletes the notifications sent, every account got `rounds` of them, and
+        takes them off the unread counts.
+        """
+        with transaction.atomic():
+            for start in range(0, len(notification_ids), REMOVE_BATCH_SIZE):
+                batch = notification_ids[start : start + REMOVE_BATCH_SIZE]
+                deletion.raw_delete(models.Notification.objects.filter(id__in=batch))
+            for start in range(0, len(account_ids), REMOVE_BATCH_SIZE):
+                batch = account_ids[start : start + REMOVE_BATCH_SIZE]
+                models.Account.objects.filter(
+                    id__in=batch, unread_notification_count__gte=rounds
+                ).update(
+                    unread_notification_count=F("unread_notification_count") - rounds
+                )
+            versions.bump(*(versions.notifications_scope(i) for i in account_ids))
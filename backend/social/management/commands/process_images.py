@@ -0,0 +1,185 @@
+import itertools
+import os
+import time
+from concurrent.futures import as_completed
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from social import images
+from social.models import Account, ImagePost
+
+PICTURE_FIELDS = ("profile_picture", "banner_picture")
+
+
+class Command(BaseCommand):
+    help = (
+        "Verifies and renders the resized variants of images that do not have "
+        "them yet, across a pool of worker processes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of worker processes",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of images handed to the workers at a time",
+        )
+        parser.add_argument(
+            "--watch",
+            action="store_true",
+            help="Keep processing new uploads, for IMAGE_PROCESSING=queue",
+        )
+        parser.add_argument(
+            "--stale-after",
+            type=float,
+            default=300,
+            help="Seconds after which a pending or processing image post is "
+            "taken to be lost, e.g. by a server restart, and processed again",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=0.5,
+            help="Seconds to sleep when no upload is pending",
+        )
+
+    def handle(self, *args, **options):
+        self.processed = 0
+        self.errors = []
+        executor = images.create_executor(options["workers"])
+        try:
+            if options["watch"]:
+                self.watch(executor, options)
+            else:
+                jobs = self.backfill_jobs(options["stale_after"])
+                while batch := list(itertools.islice(jobs, options["batch_size"])):
+                    self.run_jobs(executor, batch)
+                self.report()
+        finally:
+            executor.shutdown()
+
+    def watch(self, executor, options):
+        # Claims left behind by a worker that stopped mid-batch
+        ImagePost.objects.filter(state=images.PROCESSING).update(state=images.PENDING)
+        for field in PICTURE_FIELDS:
+            Account.objects.filter(**{f"{field}_state": images.PROCESSING}).update(
+                **{f"{field}_state": images.PENDING}
+            )
+        while True:
+            jobs = self.claim_pending(options["batch_size"])
+            if jobs:
+                self.run_jobs(executor, jobs)
+                self.report()
+            else:
+                close_old_connections()
+                time.sleep(options["poll_interval"])
+
+    def claim_pending(self, batch_size):
+        with transaction.atomic():
+            # skip_locked lets several watchers share the pending uploads
+            image_posts = list(
+                ImagePost.objects.select_for_update(skip_locked=True)
+                .filter(state=images.PENDING)
+                .order_by("id")[:batch_size]
+            )
+            ImagePost.objects.filter(
+                id__in=[image_post.id for image_post in image_posts]
+            ).update(state=images.PROCESSING)
+
+            accounts = list(
+                Account.objects.select_for_update(skip_locked=True)
+                .filter(
+                    Q(profile_picture_state=images.PENDING)
+                    | Q(banner_picture_state=images.PENDING)
+                )
+                .order_by("id")[:batch_size]
+            )
+            pictures = [
+                (account, field)
+                for account in accounts
+                for field in PICTURE_FIELDS
+                if getattr(account, f"{field}_state") == images.PENDING
+            ]
+            for account, field in pictures:
+                Account.objects.filter(id=account.id).update(
+                    **{f"{field}_state": images.PROCESSING}
+                )
+        return [self.image_post_job(image_post) for image_post in image_posts] + [
+            self.account_picture_job(account, field)
+            for account, field in pictures
+            if getattr(account, field)
+        ]
+
+    def backfill_jobs(self, stale_after):
+        # Uploads whose pool job was lost with its server process are left
+        # pending, as no queue worker claims them in pool mode
+        stale = Q(
+            state__in=[images.PENDING, images.PROCESSING],
+            post__created_at__lt=timezone.now() - timedelta(seconds=stale_after),
+        )
+        for image_post in ImagePost.objects.filter(
+            Q(state=images.READY, variants={}) | stale
+        ).iterator():
+            yield self.image_post_job(image_post)
+
+        accounts = Account.objects.filter(
+            Q(profile_picture_variants={}) & ~Q(profile_picture="")
+            | Q(banner_picture_variants={}) & ~Q(banner_picture="")
+        )
+        for account in accounts.iterator():
+            for field in PICTURE_FIELDS:
+                if not getattr(account, field) or getattr(account, f"{field}_variants"):
+                    continue
+                yield self.account_picture_job(account, field)
+
+    def image_post_job(self, image_post):
+        return (
+            f"image post {image_post.id}",
+            images.image_post_job(image_post),
+            lambda result, id=image_post.id: images.finish_image_post(id, result),
+        )
+
+    def account_picture_job(self, account, field):
+        return (
+            f"{field} of {account}",
+            images.account_picture_job(account, field),
+            lambda result, id=account.id, name=getattr(account, field).name: (
+                images.finish_account_picture(id, field, name, result)
+            ),
+        )
+
+    def run_jobs(self, executor, jobs):
+        """Renders in the workers, storing each result as it comes back."""
+        futures = {
+            executor.submit(images.render_job, *job): (label, finish)
+            for label, job, finish in jobs
+        }
+        for future in as_completed(futures):
+            label, finish = futures[future]
+            try:
+                finish(future.result)
+            except Exception as e:
+                self.errors.append(f"Error storing {label}: {e}")
+                continue
+            if future.exception() is not None:
+                self.errors.append(f"Error processing {label}: {future.exception()}")
+            else:
+                self.processed += 1
+
+    def report(self):
+        self.stdout.write(self.style.SUCCESS(f"Processed {self.processed} images"))
+        if self.errors:
+            self.stdout.write(self.style.WARNING("Errors:"))
+            for error in self.errors:
+                self.stdout.write(self.style.ERROR(error))
+        self.processed = 0
+        self.errors = []
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from social import deletion
+
+
+class Command(BaseCommand):
+    help = "Removes soft-deleted posts and their replies in bulk batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=deletion.BATCH_SIZE,
+            help="Number of posts to remove per batch",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=5.0,
+            help="Seconds to sleep when nothing is left to remove",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Remove everything pending once and exit",
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            started = time.monotonic()
+            removed = deletion.reap_batch(options["batch_size"])
+            close_old_connections()
+            if removed:
+                total += removed
+                elapsed = (time.monotonic() - started) * 1000
+                self.stdout.write(f"Removed {removed} posts in {elapsed:.1f}ms")
+                continue
+            if options["once"]:
+                self.stdout.write(self.style.SUCCESS(f"Removed {total} posts"))
+                return
+            time.sleep(options["poll_interval"])
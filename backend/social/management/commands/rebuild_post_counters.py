@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from social.counters import POST_COUNTERS, actual_counts
+from social.models import Post
+
+
+class Command(BaseCommand):
+    help = "Recomputes the denormalized favorite/repost/reply counters on posts"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of posts to check per batch",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report drifted posts without writing the corrected counters",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        dry_run = options["dry_run"]
+        checked = 0
+        drifted = 0
+        last_id = 0
+
+        while True:
+            posts = list(
+                Post.objects.filter(id__gt=last_id)
+                .order_by("id")
+                .only("id", *POST_COUNTERS)
+                .annotate(**{f"actual_{c}": e for c, e in actual_counts().items()})[
+                    :batch_size
+                ]
+            )
+            if not posts:
+                break
+            last_id = posts[-1].id
+            checked += len(posts)
+
+            changed = [
+                post.id
+                for post in posts
+                if any(
+                    getattr(post, counter) != getattr(post, f"actual_{counter}")
+                    for counter in POST_COUNTERS
+                )
+            ]
+            drifted += len(changed)
+
+            if changed and not dry_run:
+                # Recount inside the UPDATE itself so concurrent toggles are not lost
+                with transaction.atomic():
+                    Post.objects.filter(id__in=changed).update(**actual_counts())
+
+        verb = "Found" if dry_run else "Repaired"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Checked {checked} posts. {verb} {drifted} with drifted counters"
+            )
+        )
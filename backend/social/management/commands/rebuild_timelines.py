@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from social import timeline
+from social.models import Account, Follow, TimelineEntry
+
+
+class Command(BaseCommand):
+    help = "Rebuilds or trims the precomputed home timelines of every account"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--trim-only",
+            action="store_true",
+            help="Only trim timelines down to TIMELINE_MAX_LENGTH entries",
+        )
+
+    def handle(self, *args, **options):
+        account_ids = Account.objects.order_by("id").values_list("id", flat=True)
+
+        if options["trim_only"]:
+            trimmed = sum(timeline.trim(account_id) for account_id in account_ids)
+            self.stdout.write(self.style.SUCCESS(f"Trimmed {trimmed} entries"))
+            return
+
+        follower_counts = (
+            Follow.objects.filter(following=OuterRef("pk"))
+            .order_by()
+            .values("following")
+            .annotate(count=Count("id"))
+            .values("count")
+        )
+        Account.objects.update(
+            follower_count=Coalesce(
+                Subquery(follower_counts, output_field=IntegerField()), Value(0)
+            )
+        )
+
+        rebuilt = 0
+        for account_id in account_ids.iterator():
+            account = Account.objects.get(id=account_id)
+            followed = Account.objects.filter(
+                id__in=timeline.following_ids(account),
+                follower_count__lte=settings.TIMELINE_FANOUT_LIMIT,
+            )
+            posts = list(
+                timeline.top_level_posts()
+                .filter(account__in=followed)
+                .order_by("-created_at")[: settings.TIMELINE_MAX_LENGTH]
+            )
+            with transaction.atomic():
+                TimelineEntry.objects.filter(account=account).delete()
+                timeline.push_entries([account.id], posts)
+            rebuilt += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} timelines"))
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Min
+from social.models import Favorite, Follow, Post, Repost
+
+# Must be clean before the unique constraints on these pairs can be applied
+RELATIONS = [
+    (Follow, ("follower", "following")),
+    (Favorite, ("account", "post")),
+    (Repost, ("account", "original_post")),
+]
+
+
+class Command(BaseCommand):
+    help = "Deletes duplicate follows, favorites and reposts, keeping the oldest"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report duplicates without deleting them",
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        for model, fields in RELATIONS:
+            groups = (
+                model.objects.values(*fields)
+                .annotate(keep=Min("id"), count=Count("id"))
+                .filter(count__gt=1)
+            )
+            duplicate_ids = []
+            for group in groups:
+                keep = group.pop("keep")
+                group.pop("count")
+                duplicate_ids += (
+                    model.objects.filter(**group)
+                    .exclude(id=keep)
+                    .values_list("id", flat=True)
+                )
+            total += len(duplicate_ids)
+            self.stdout.write(f"{model.__name__}: {len(duplicate_ids)} duplicate rows")
+            if options["dry_run"] or not duplicate_ids:
+                continue
+
+            with transaction.atomic():
+                if model is Repost:
+                    # A duplicate repost also created its own repost post
+                    Post.objects.filter(
+                        id__in=Repost.objects.filter(id__in=duplicate_ids).values(
+                            "post"
+                        )
+                    ).delete()
+                model.objects.filter(id__in=duplicate_ids).delete()
+
+        if total and not options["dry_run"]:
+            self.stdout.write(
+                self.style.WARNING(
+                    "Run rebuild_post_counters and rebuild_timelines to recount"
+                )
+            )
+        self.stdout.write(self.style.SUCCESS(f"Found {total} duplicate rows"))
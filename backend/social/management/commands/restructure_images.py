@@ -1,49 +1,185 @@
+from concurrent.futures import ThreadPoolExecutor
 from django.core.management.base import BaseCommand
 from django.conf import settings
+from django.db import transaction
+from social import media
 from social.models import ImagePost
+import json
 import os
-from datetime import datetime
 import shutil
+import time
 
 
 class Command(BaseCommand):
     help = "Moves existing images into user specific folders (or adjust the code to any directory)"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help="Number of image posts read and updated at a time",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=8,
+            help="Number of threads moving files",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            default=os.path.join(settings.MEDIA_ROOT, ".restructure_images.json"),
+            help="File recording progress, so an interrupted run resumes",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the checkpoint and start from the first image post",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report what would be moved and how fast rows are read",
+        )
+
     def handle(self, *args, **options):
-        image_posts = ImagePost.objects.all()
+        self.dry_run = options["dry_run"]
+        self.checkpoint = options["checkpoint"]
+        last_id = 0 if options["restart"] else self.read_checkpoint()
+        if last_id:
+            self.stdout.write(f"Resuming after image post {last_id}")
+
+        scanned = 0
         moved_count = 0
         errors = []
+        started = time.monotonic()
 
-        for post in image_posts:
-            try:
-                old_path = os.path.join(settings.MEDIA_ROOT, str(post.image))
-
-                if "users" in old_path:
-                    continue
-
-                username = post.post.account.user.username
-                filename = os.path.basename(old_path.split("/")[-1])
-                new_relative_path = f'users/{username}/images/{datetime.now().strftime("%Y/%m/%d")}/{filename}'
-                new_full_path = os.path.join(settings.MEDIA_ROOT, new_relative_path)
-
-                os.makedirs(os.path.dirname(new_full_path), exist_ok=True)
-
-                if os.path.exists(old_path):
-                    shutil.move(old_path, new_full_path)
-
-                    post.image = new_relative_path
-                    post.save()
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            while True:
+                chunk = list(
+                    ImagePost.objects.filter(id__gt=last_id)
+                    .select_related("post__account__user")
+                    .order_by("id")[: options["chunk_size"]]
+                )
+                if not chunk:
+                    break
+                scanned += len(chunk)
+                last_id = chunk[-1].id
 
+                moves = [
+                    (post, self.old_path(post), self.new_relative_path(post))
+                    for post in chunk
+                    if self.needs_move(post)
+                ]
+                results = pool.map(lambda move: self.move(move[0].id, *move[1:]), moves)
+                updated = []
+                for (post, _, _), (new_relative_path, error) in zip(moves, results):
+                    if error:
+                        errors.append(f"Error processing {post.id}: {error}")
+                        continue
+                    post.image.name = new_relative_path
+                    updated.append(post)
                     moved_count += 1
-                    self.stdout.write(f"Moved: {old_path} -> {new_full_path}")
-                else:
-                    errors.append(f"File not found: {old_path}")
 
-            except Exception as e:
-                errors.append(f"Error processing {post.id}: {str(e)}")
+                if not self.dry_run:
+                    with transaction.atomic():
+                        ImagePost.objects.bulk_update(updated, ["image"])
+                    self.write_checkpoint(last_id)
 
-        self.stdout.write(self.style.SUCCESS(f"Moved {moved_count} files"))
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f"Scanned {scanned} image posts, {moved_count} files moved, "
+                    f"{scanned / elapsed:.0f} rows/s"
+                )
+
+        elapsed = time.monotonic() - started
+        verb = "Would move" if self.dry_run else "Moved"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{verb} {moved_count} files in {elapsed:.1f}s "
+                f"({moved_count / elapsed if elapsed else 0:.0f} files/s)"
+            )
+        )
+        if not self.dry_run and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
         if errors:
             self.stdout.write(self.style.WARNING("Errors:"))
             for error in errors:
                 self.stdout.write(self.style.ERROR(error))
+
+    def needs_move(self, post):
+        # Content-addressed blobs are where social.media wants them already
+        name = str(post.image)
+        return "users" not in name and not media.is_blob(name)
+
+    def old_path(self, post):
+        return os.path.join(settings.MEDIA_ROOT, str(post.image))
+
+    def new_relative_path(self, post):
+        username = post.post.account.user.username
+        filename = os.path.basename(str(post.image))
+        # Dated by the post, so a resumed run picks the same folders
+        return f'users/{username}/images/{post.post.created_at.strftime("%Y/%m/%d")}/{filename}'
+
+    def move(self, post_id, old_path, new_relative_path):
+        """
+        Moves one file, returning (new relative path, error). A file already
+        at its destination was moved by an interrupted run.
+        """
+        stem, extension = os.path.splitext(new_relative_path)
+        # Two files with the same name from the same day
+        renamed_path = f"{stem}_{post_id}{extension}"
+        new_full_path = os.path.join(settings.MEDIA_ROOT, new_relative_path)
+
+        if not os.path.exists(old_path):
+            for candidate in (renamed_path, new_relative_path):
+                if os.path.exists(os.path.join(settings.MEDIA_ROOT, candidate)):
+                    return candidate, None
+            return None, f"File not found: {old_path}"
+
+        if self.dry_run:
+            if os.path.exists(new_full_path):
+                return renamed_path, None
+            return new_relative_path, None
+        try:
+            for candidate in (new_relative_path, renamed_path):
+                if self.claim(candidate):
+                    break
+            else:
+                return None, f"Destination taken: {renamed_path}"
+            full_path = os.path.join(settings.MEDIA_ROOT, candidate)
+            try:
+                shutil.move(old_path, full_path)
+            except OSError:
+                os.remove(full_path)
+                raise
+        except OSError as e:
+            return None, str(e)
+        return candidate, None
+
+    def claim(self, relative_path):
+        """
+        Creates an empty file at `relative_path` unless there is one already.
+        The check and the creation are one step, so of several workers
+        moving files with the same name only one gets each destination.
+        """
+        full_path = os.path.join(settings.MEDIA_ROOT, relative_path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        try:
+            os.close(os.open(full_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return False
+        return True
+
+    def read_checkpoint(self):
+        try:
+            with open(self.checkpoint) as f:
+                return json.load(f)["last_id"]
+        except FileNotFoundError:
+            return 0
+
+    def write_checkpoint(self, last_id):
+        # Replaced atomically, so an interruption never leaves half a file
+        with open(f"{self.checkpoint}.tmp", "w") as f:
+            json.dump({"last_id": last_id}, f)
+        os.replace(f"{self.checkpoint}.tmp", self.checkpoint)
@@ -0,0 +1,171 @@
+import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timezone
+from itertools import repeat
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from PIL import Image as PILImage
+from social import seeding
+from social.models import User
+
+
+def placeholder_image():
+    buffer = io.BytesIO()
+    PILImage.new("RGB", (640, 480), (90, 120, 160)).save(buffer, "JPEG")
+    return default_storage.save("seed/placeholder.jpg", ContentFile(buffer.getvalue()))
+
+
+class Command(BaseCommand):
+    help = "Generates a large, reproducible social graph for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--accounts", type=int, default=1000)
+        parser.add_argument(
+            "--posts", type=int, default=10, help="Average top-level posts per account"
+        )
+        parser.add_argument(
+            "--replies",
+            type=int,
+            default=3,
+            help="Average replies per account at each level of the reply trees",
+        )
+        parser.add_argument(
+            "--reply-depth", type=int, default=3, help="Levels of replies below posts"
+        )
+        parser.add_argument(
+            "--follows", type=int, default=20, help="Average follows per account"
+        )
+        parser.add_argument(
+            "--favorites", type=int, default=20, help="Average favorites per account"
+        )
+        parser.add_argument(
+            "--reposts", type=int, default=2, help="Average reposts per account"
+        )
+        parser.add_argument(
+            "--days", type=int, default=365, help="Span the timestamps are spread over"
+        )
+        parser.add_argument(
+            "--until",
+            type=date.fromisoformat,
+            default=datetime.now(timezone.utc).date(),
+            help="Day the timestamps end on, today by default. Pass the same "
+            "one to reproduce a dataset on another day",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--prefix", default="user", help="Usernames are the prefix and a number"
+        )
+        parser.add_argument(
+            "--password", default="password", help="Password of every account"
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="Processes inserting in parallel, one per CPU on PostgreSQL",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Accounts per unit of work. Changing it changes the dataset",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Rows per INSERT statement",
+        )
+        parser.add_argument(
+            "--timelines",
+            action="store_true",
+            help="Rebuild the home timelines afterwards",
+        )
+
+    def handle(self, *args, **options):
+        prefix = options["prefix"]
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(
+                f"Usernames starting with {prefix!r} exist already, pick another --prefix"
+            )
+        workers = options["workers"]
+        if connection.vendor == "sqlite":
+            # SQLite takes one writer at a time, more would only wait on locks
+            workers = 1
+        elif workers is None:
+            workers = os.cpu_count()
+
+        started = time.monotonic()
+        plan = seeding.Plan(
+            seed=options["seed"],
+            accounts=options["accounts"],
+            chunk_size=options["chunk_size"],
+            averages={
+                "posts": options["posts"],
+                "replies": options["replies"],
+                "follows": options["follows"],
+                "favorites": options["favorites"],
+                "reposts": options["reposts"],
+            },
+            depth=options["reply_depth"],
+            end=datetime.combine(options["until"], datetime.min.time(), timezone.utc),
+            days=options["days"],
+            prefix=prefix,
+            password=make_password(options["password"]),
+            image=placeholder_image(),
+            batch_size=options["batch_size"],
+        )
+        chunks = plan.chunks()
+
+        total = 0
+        executor = None
+        if workers > 1:
+            # spawn, as forking a process that holds database connections is
+            # not safe. Each worker sets Django up and opens its own.
+            executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=django.setup,
+            )
+            connection.close()
+        try:
+            for phase in plan.phases():
+                phase_started = time.monotonic()
+                if executor:
+                    results = executor.map(
+                        seeding.seed_chunk, repeat(plan), repeat(phase), chunks
+                    )
+                else:
+                    results = (seeding.seed_chunk(plan, phase, c) for c in chunks)
+                rows = sum(results)
+                total += rows
+                self.report(phase, rows, time.monotonic() - phase_started)
+        finally:
+            if executor:
+                executor.shutdown()
+
+        finish_started = time.monotonic()
+        seeding.finish(plan)
+        self.report("counters", 0, time.monotonic() - finish_started)
+        if options["timelines"]:
+            call_command("rebuild_timelines", stdout=self.stdout)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Seeded {total} rows with {workers} workers in {elapsed:.1f}s "
+                f"({total / elapsed:.0f} rows/s)"
+            )
+        )
+
+    def report(self, phase, rows, elapsed):
+        rate = f", {rows / elapsed:.0f} rows/s" if rows and elapsed else ""
+        self.stdout.write(f"{phase}: {rows} rows in {elapsed:.1f}s{rate}")
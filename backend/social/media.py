@@ -0,0 +1,131 @@
+"""
+Content-addressed storage for uploads and their variants.
+
+A file is stored once under the SHA-256 of its bytes, whatever name it was
+uploaded with, so re-uploading identical bytes costs a MediaBlob reference
+instead of another copy. Every save takes a reference and every delete drops
+one; the file itself is removed once the last reference is gone. Blob names
+never change content, so their URLs can be cached forever.
+
+Files stored before this, under their upload names, are not counted and are
+deleted as before. The dedupe_media management command moves them into
+blobs.
+"""
+
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+from django.views import static
+
+BLOB_PREFIX = "blobs/"
+HASH_CHUNK_SIZE = 64 * 1024
+# Cache-Control of media served from blob names
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def content_hash(content):
+    # Uploads are hashed while they stream in, see social.uploads
+    if getattr(content, "content_hash", None):
+        return content.content_hash
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def blob_name(digest, name):
+    extension = os.path.splitext(name)[1].lower()
+    return f"{BLOB_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+
+def is_blob(name):
+    return name.startswith(BLOB_PREFIX)
+
+
+def acquire(name, size):
+    """Takes a reference to a stored blob."""
+    from social.models import MediaBlob
+
+    if MediaBlob.objects.filter(name=name).update(ref_count=F("ref_count") + 1):
+        return
+    try:
+        with transaction.atomic():
+            MediaBlob.objects.create(name=name, size=size, ref_count=1)
+    except IntegrityError:
+        # Created by a concurrent upload of the same bytes
+        MediaBlob.objects.filter(name=name).update(ref_count=F("ref_count") + 1)
+
+
+def release(name):
+    """
+    Drops a reference to a blob. Returns True once no reference is left,
+    meaning the file can go when the current transaction commits. The row is
+    kept until then, for delete_unreferenced to lock.
+    """
+    from social.models import MediaBlob
+
+    MediaBlob.objects.filter(name=name, ref_count__gt=0).update(
+        ref_count=F("ref_count") - 1
+    )
+    return not MediaBlob.objects.filter(name=name, ref_count__gt=0).exists()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def __init__(self, **kwargs):
+        # Identical names hold identical bytes, so rewriting one is harmless
+        kwargs.setdefault("allow_overwrite", True)
+        super().__init__(**kwargs)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, "chunks"):
+            from django.core.files import File
+
+            content = File(content, name)
+        name = blob_name(content_hash(content), name)
+        # Referenced before the file is checked, so delete_unreferenced either
+        # sees the reference or has removed the file by the time it is checked
+        acquire(name, content.size)
+        if not self.exists(name):
+            name = super().save(name, content, max_length=max_length)
+        return name
+
+    def delete(self, name):
+        if not name:
+            return
+        if is_blob(name):
+            if release(name):
+                # Checked again as the blob may be taken by another upload
+                # before the deletion
+                transaction.on_commit(lambda: self.delete_unreferenced(name))
+            return
+        super().delete(name)
+
+    def delete_unreferenced(self, name):
+        from social.models import MediaBlob
+
+        with transaction.atomic():
+            # Locked, so a concurrent upload of the same bytes waits to take
+            # its reference until the file and the row are gone
+            blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+            if blob is None or blob.ref_count > 0:
+                return
+            super().delete(name)
+            blob.delete()
+
+
+def serve(request, path):
+    """Serves MEDIA_ROOT, marking blobs as cacheable forever."""
+    response = static.serve(request, path, document_root=settings.MEDIA_ROOT)
+    if is_blob(path):
+        response["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
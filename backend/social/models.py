@@ -1,12 +1,12 @@
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Greatest
 from django.contrib.auth import get_user_model
 from datetime import datetime
 from django.db.models.signals import pre_delete, pre_save, post_save
 from django.dispatch import receiver
-import os
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-import json
+from notification import dispatch
+from social import images, versions
 import logging
 
 logger = logging.getLogger(__name__)
@@ -22,6 +22,15 @@ def user_image_path(self, filename):
     return f'users/{username}/images/{datetime.now().strftime("%Y/%m/%d")}/{filename}'
 
 
+# Progress of verification and rendering in the image workers
+IMAGE_STATES = [
+    (images.PENDING, "Pending"),
+    (images.PROCESSING, "Processing"),
+    (images.READY, "Ready"),
+    (images.FAILED, "Failed"),
+]
+
+
 class Account(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="account")
     display_name = models.CharField(max_length=255)
@@ -30,6 +39,29 @@ class Account(models.Model):
         upload_to=user_image_path, blank=True, null=True
     )
     banner_picture = models.ImageField(upload_to=user_image_path, blank=True, null=True)
+    # Storage names of the resized re-encodes, see social.images
+    profile_picture_variants = models.JSONField(default=dict, blank=True)
+    banner_picture_variants = models.JSONField(default=dict, blank=True)
+    profile_picture_state = models.CharField(
+        max_length=16, choices=IMAGE_STATES, default=images.READY
+    )
+    banner_picture_state = models.CharField(
+        max_length=16, choices=IMAGE_STATES, default=images.READY
+    )
+    # Maintained by Follow.post, used to pick fan-out-on-read for large accounts
+    follower_count = models.PositiveIntegerField(default=0)
+    # Maintained by the Notification signals and the read paths in views
+    unread_notification_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["id"],
+                condition=models.Q(profile_picture_state="pending")
+                | models.Q(banner_picture_state="pending"),
+                name="account_picture_pending_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.user.username
@@ -47,32 +79,91 @@ def delete_old_profile_images(sender, instance, **kwargs):
                 old_instance.profile_picture
                 and old_instance.profile_picture != instance.profile_picture
             ):
-                if os.path.isfile(old_instance.profile_picture.path):
-                    os.remove(old_instance.profile_picture.path)
+                old_instance.profile_picture.storage.delete(
+                    old_instance.profile_picture.name
+                )
+                images.delete_variants(old_instance.profile_picture_variants)
+                instance.profile_picture_variants = {}
 
             # Check if banner picture has changed
             if (
                 old_instance.banner_picture
                 and old_instance.banner_picture != instance.banner_picture
             ):
-                if os.path.isfile(old_instance.banner_picture.path):
-                    os.remove(old_instance.banner_picture.path)
+                old_instance.banner_picture.storage.delete(
+                    old_instance.banner_picture.name
+                )
+                images.delete_variants(old_instance.banner_picture_variants)
+                instance.banner_picture_variants = {}
 
         except Account.DoesNotExist:
             pass
 
 
+class LivePostManager(models.Manager):
+    """Leaves out posts waiting to be reaped, see social.deletion."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class Post(models.Model):
     account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name="posts")
     created_at = models.DateTimeField(auto_now_add=True)
     reply_to = models.ForeignKey(
         "self", on_delete=models.CASCADE, related_name="replies", null=True, blank=True
     )
+    # Denormalized counters, kept in step by adjust_post_counter and repaired
+    # in bulk by the rebuild_post_counters management command
+    favorite_count = models.PositiveIntegerField(default=0)
+    repost_count = models.PositiveIntegerField(default=0)
+    reply_count = models.PositiveIntegerField(default=0)
+    # Set when the post and its replies are deleted, hiding them until the
+    # reap_deleted_posts command removes the rows
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = LivePostManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        # Keyset pagination walks these in (created_at, id) order, see
+        # social.pagination
+        indexes = [
+            models.Index(
+                fields=["-created_at", "-id"],
+                condition=models.Q(reply_to__isnull=True, deleted_at__isnull=True),
+                name="post_top_level_created_idx",
+            ),
+            models.Index(
+                fields=["account", "-created_at", "-id"],
+                name="post_account_created_idx",
+            ),
+            models.Index(
+                fields=["reply_to", "-created_at", "-id"],
+                name="post_reply_created_idx",
+            ),
+            models.Index(
+                fields=["id"],
+                condition=models.Q(deleted_at__isnull=False),
+                name="post_deleted_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.account.user.username} - {self.created_at}"
 
 
+def adjust_post_counter(post_id, field, delta):
+    """
+    Atomically shifts one of a post's counters, never taking it below zero.
+    Should be called inside the same transaction as the row change it mirrors.
+    """
+    posts = Post.objects.filter(id=post_id)
+    if delta < 0:
+        posts = posts.filter(**{f"{field}__gte": -delta})
+    posts.update(**{field: F(field) + delta})
+
+
 class TextPost(models.Model):
     post = models.OneToOneField(
         Post, on_delete=models.CASCADE, related_name="text_post"
@@ -99,6 +190,18 @@ class ImagePost(models.Model):
     )
     image = models.ImageField(upload_to=user_image_path)
     caption = models.CharField(max_length=255, blank=True)
+    # Storage names of the resized re-encodes, see social.images
+    variants = models.JSONField(default=dict, blank=True)
+    state = models.CharField(max_length=16, choices=IMAGE_STATES, default=images.READY)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["id"],
+                condition=models.Q(state="pending"),
+                name="imagepost_pending_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.image.url
@@ -106,8 +209,9 @@ class ImagePost(models.Model):
 
 @receiver(pre_delete, sender=ImagePost)
 def delete_image_file(sender, instance, **kwargs):
-    if instance.image and os.path.isfile(instance.image.path):
-        os.remove(instance.image.path)
+    if instance.image:
+        instance.image.storage.delete(instance.image.name)
+    images.delete_variants(instance.variants)
 
 
 class Follow(models.Model):
@@ -118,6 +222,16 @@ class Follow(models.Model):
         Account, on_delete=models.CASCADE, related_name="followers"
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["following", "follower"], name="follow_following_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["follower", "following"], name="follow_unique_pair"
+            ),
+        ]
+
     def __str__(self):
         return f"{self.follower.user.username} follows {self.following.user.username}"
 
@@ -130,6 +244,13 @@ class Favorite(models.Model):
         Post, on_delete=models.CASCADE, related_name="favorited_by"
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["account", "post"], name="favorite_unique_account_post"
+            ),
+        ]
+
     def __str__(self):
         return f"{self.account.user.username} favorited {self.post.id}"
 
@@ -145,10 +266,55 @@ class Repost(models.Model):
         Post, on_delete=models.CASCADE, related_name="reposted_by"
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["original_post", "account"], name="repost_original_idx"
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["account", "original_post"],
+                name="repost_unique_account_original",
+            ),
+            models.UniqueConstraint(fields=["post"], name="repost_unique_post"),
+        ]
+
     def __str__(self):
         return f"{self.account.user.username} reposted {self.post.id}"
 
 
+class TimelineEntry(models.Model):
+    """
+    A post pushed into a follower's home timeline when it was written.
+    created_at mirrors the post's so a timeline page is one index range scan.
+    """
+
+    account = models.ForeignKey(
+        Account, on_delete=models.CASCADE, related_name="timeline"
+    )
+    post = models.ForeignKey(
+        Post, on_delete=models.CASCADE, related_name="timeline_entries"
+    )
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["account", "-created_at", "-post"],
+                name="timeline_account_created_idx",
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["account", "post"], name="timeline_unique_account_post"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.account.user.username} timeline - {self.post_id}"
+
+
 class Notification(models.Model):
     account = models.ForeignKey(
         Account, on_delete=models.CASCADE, related_name="notifications"
@@ -163,52 +329,85 @@ class Notification(models.Model):
         Account, on_delete=models.CASCADE, related_name="action_account"
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["account", "-created_at", "-id"],
+                name="notification_account_idx",
+            ),
+            # Lookups made when a favorite, repost or follow is toggled off
+            models.Index(
+                fields=["account", "action_account", "action"],
+                name="notification_action_idx",
+            ),
+            models.Index(
+                fields=["account"],
+                condition=models.Q(read=False),
+                name="notification_unread_idx",
+            ),
+        ]
+
     def __str__(self):
         return f"{self.account.user.username} notified about {self.action_account.user.username} {self.action}"
 
 
+def visible_notifications(account_id):
+    """An account's notifications, without those about deleted posts."""
+    return Notification.objects.filter(account_id=account_id).filter(
+        models.Q(post__isnull=True) | models.Q(post__deleted_at__isnull=True)
+    )
+
+
+def adjust_unread_count(account_id, delta):
+    # Bulk decrements clamp at zero rather than being skipped
+    Account.objects.filter(id=account_id).update(
+        unread_notification_count=Greatest(F("unread_notification_count") + delta, 0)
+    )
+
+
 @receiver(post_save, sender=Notification)
-def send_notification(sender, instance, **kwargs):
+def send_notification(sender, instance, created, **kwargs):
     if instance.read:
         return
-    user_id = instance.account.user.id
-    notification_stream = instance.account.notification_stream.first()
-    if not notification_stream:
-        return
-    token = notification_stream.token
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"notification_{user_id}_{token}",
-        {
-            "type": "send_notification",
-            "message": {
-                "action": instance.action,
-                "action_account": instance.action_account.user.username,
-                "action_account_displayname": instance.action_account.display_name,
-                "read": instance.read,
-                "created_at": (
-                    instance.created_at.isoformat() if instance.created_at else None
-                ),
-                "post_id": instance.post.id if instance.post else None,
-                "notification_id": instance.id,
-            },
-        },
-    )
+    if created:
+        adjust_unread_count(instance.account_id, 1)
+    versions.bump(versions.notifications_scope(instance.account_id))
+    dispatch.enqueue(instance.account_id, dispatch.notification_event(instance))
 
 
 @receiver(pre_delete, sender=Notification)
 def delete_notification(sender, instance, **kwargs):
-    notification_id = instance.id
-    user_id = instance.account.user.id
-    token = instance.account.notification_stream.first().token
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"notification_{user_id}_{token}",
-        {
-            "type": "delete_notification",
-            "id": notification_id,
-        },
-    )
+    if not instance.read:
+        adjust_unread_count(instance.account_id, -1)
+    versions.bump(versions.notifications_scope(instance.account_id))
+    dispatch.enqueue(instance.account_id, dispatch.delete_event(instance))
+
+
+class NotificationOutbox(models.Model):
+    """
+    A websocket event waiting for the dispatch_notifications worker, used when
+    NOTIFICATION_DISPATCH is "outbox". Written in the transaction that caused
+    it, so rolled back changes never notify anyone.
+    """
+
+    account_id = models.BigIntegerField()
+    event = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.event['type']} for account {self.account_id}"
+
+
+class MediaBlob(models.Model):
+    """A stored file shared by every upload of the same bytes, see social.media"""
+
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} references)"
 
 
 class NotificationStream(models.Model):
@@ -218,5 +417,10 @@ class NotificationStream(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     token = models.CharField(max_length=255, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["account", "token"], name="stream_account_token_idx"),
+        ]
+
     def __str__(self):
         return f"{self.account.user.username} - {self.created_at}"
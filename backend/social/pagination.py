@@ -0,0 +1,102 @@
+"""
+Keyset pagination over (created_at, id).
+
+Pages are ordered newest first and continue strictly after the last row
+served, so rows sharing a timestamp are neither repeated nor skipped. The
+position is handed to clients as an opaque cursor in the X-Next-Cursor
+response header, leaving the response bodies unchanged.
+"""
+
+import base64
+from datetime import datetime, timezone
+
+from django.db.models import Q
+from rest_framework.response import Response
+
+PAGE_SIZE = 16
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at, pk):
+    raw = f"{created_at.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, pk = raw.split("|")
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(cursor) from e
+
+
+class Cursor:
+    """
+    A position in a newest-first listing. Either a keyset position taken from
+    an opaque cursor, or the legacy millisecond `timestamp` parameter, which is
+    inclusive and kept for older clients.
+    """
+
+    def __init__(self, created_at=None, pk=None, until=None):
+        self.created_at = created_at
+        self.pk = pk
+        self.until = until
+
+    @classmethod
+    def from_request(cls, request):
+        cursor = request.GET.get("cursor")
+        if cursor:
+            return cls(*decode_cursor(cursor))
+        timestamp = request.GET.get("timestamp")
+        if timestamp:
+            try:
+                until = datetime.fromtimestamp(int(timestamp) / 1000, tz=timezone.utc)
+            except (ValueError, OverflowError) as e:
+                raise InvalidCursor(timestamp) from e
+            return cls(until=until)
+        return cls()
+
+    def filter(self, created_field="created_at", pk_field="id"):
+        """Q selecting the rows that come after this position."""
+        if self.created_at is not None:
+            # The leading bound lets the (created_at, id) index start the range
+            # scan at the cursor, which the OR alone does not
+            after = Q(**{f"{created_field}__lt": self.created_at}) | Q(
+                **{created_field: self.created_at, f"{pk_field}__lt": self.pk}
+            )
+            return Q(**{f"{created_field}__lte": self.created_at}) & after
+        if self.until is not None:
+            return Q(**{f"{created_field}__lte": self.until})
+        return Q()
+
+
+def ordering(created_field="created_at", pk_field="id"):
+    return (f"-{created_field}", f"-{pk_field}")
+
+
+def paginate(queryset, cursor, limit=PAGE_SIZE):
+    """
+    Returns one page of `queryset` after `cursor` and the cursor of the next
+    page, or None when this is the last page. Fetches one extra row to tell.
+    """
+    rows = list(queryset.filter(cursor.filter()).order_by(*ordering())[: limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].pk)
+
+
+def paginated_response(data, next_cursor):
+    response = Response(data)
+    if next_cursor:
+        response[NEXT_CURSOR_HEADER] = next_cursor
+    return response
+
+
+def invalid_cursor_response():
+    return Response({"message": "Invalid cursor"}, status=400)
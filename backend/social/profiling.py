@@ -0,0 +1,432 @@
+"""
+Opt-in per-request profiling, turned on with PROFILING_ENABLED.
+
+ProfilingMiddleware measures every request: its wall time, the time and
+number of its SQL queries (and how many repeat an earlier one exactly, or
+only differ in parameters), its cache hits and misses, and the time spent
+serializing and rendering. The numbers go out three ways:
+
+- a JSON log line on the social.profiling logger,
+- a Server-Timing response header, shown by the browser's dev tools,
+- totals per view at /api/metrics, in the Prometheus text format. They are
+  kept per server process and shown to staff users and to scrapers holding
+  PROFILING_METRICS_TOKEN only.
+
+A watchdog thread logs the stack of any request still running after
+PROFILING_SLOW_MS, which shows where a slow request is stuck. A
+PROFILING_SAMPLE_RATE fraction of requests also runs under cProfile, and
+the hottest functions of those that turn out slow are logged too.
+"""
+
+import contextvars
+import cProfile
+import functools
+import io
+import json
+import logging
+import pstats
+import random
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the request duration histogram, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Functions listed from a sampled cProfile run
+PROFILE_LINES = 25
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+current = contextvars.ContextVar("request_profile", default=None)
+
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.thread_id = threading.get_ident()
+        self.wall = 0.0
+        self.db_time = 0.0
+        self.queries = 0
+        self.duplicate_queries = 0
+        self.similar_queries = 0
+        self.cache_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # Set while inside a cache lookup, whose backend may make more of them
+        self.in_cache = False
+        # Seconds per timed() section, see below
+        self.sections = defaultdict(float)
+        self.stack = None
+        self._executed = Counter()
+        self._statements = Counter()
+
+    def execute(self, execute, sql, params, many, context):
+        """A database execute_wrapper timing every query."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            key = hash((sql, repr(params)))
+            self._executed[key] += 1
+            self._statements[sql] += 1
+            if self._executed[key] > 1:
+                self.duplicate_queries += 1
+            elif self._statements[sql] > 1:
+                self.similar_queries += 1
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        entries = [
+            f"total;dur={self.wall * 1000:.1f}",
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+            f"cache;dur={self.cache_time * 1000:.1f};"
+            f'desc="{self.cache_hits} hits, {self.cache_misses} misses"',
+        ]
+        entries += [
+            f"{name};dur={seconds * 1000:.1f}"
+            for name, seconds in self.sections.items()
+        ]
+        return ", ".join(entries)
+
+    def as_dict(self):
+        return {
+            "wall_ms": round(self.wall * 1000, 2),
+            "db_ms": round(self.db_time * 1000, 2),
+            "queries": self.queries,
+            "duplicate_queries": self.duplicate_queries,
+            "similar_queries": self.similar_queries,
+            "cache_ms": round(self.cache_time * 1000, 2),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            **{
+                f"{name}_ms": round(seconds * 1000, 2)
+                for name, seconds in self.sections.items()
+            },
+        }
+
+
+def timed(name):
+    """
+    Adds the time spent in the decorated function to the current request's
+    `name` section, leaving out the queries it runs, which count as db time.
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            profile = current.get()
+            if profile is None:
+                return function(*args, **kwargs)
+            started = time.perf_counter()
+            db_time = profile.db_time
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                profile.sections[name] += elapsed - (profile.db_time - db_time)
+
+        return wrapper
+
+    return decorator
+
+
+def profiled_get(get):
+    @functools.wraps(get)
+    def wrapper(self, key, default=None, version=None):
+        profile = current.get()
+        if profile is None or profile.in_cache:
+            return get(self, key, default, version)
+        started = time.perf_counter()
+        profile.in_cache = True
+        try:
+            value = get(self, key, default, version)
+        finally:
+            profile.in_cache = False
+        profile.cache_time += time.perf_counter() - started
+        if value is default:
+            profile.cache_misses += 1
+        else:
+            profile.cache_hits += 1
+        return value
+
+    return wrapper
+
+
+def profiled_get_many(get_many):
+    @functools.wraps(get_many)
+    def wrapper(self, keys, version=None):
+        profile = current.get()
+        if profile is None or profile.in_cache:
+            return get_many(self, keys, version)
+        keys = list(keys)
+        started = time.perf_counter()
+        profile.in_cache = True
+        try:
+            found = get_many(self, keys, version)
+        finally:
+            profile.in_cache = False
+        profile.cache_time += time.perf_counter() - started
+        profile.cache_hits += len(found)
+        profile.cache_misses += len(keys) - len(found)
+        return found
+
+    return wrapper
+
+
+def instrument_caches():
+    """Counts the hits and misses of every configured cache backend."""
+    for alias in settings.CACHES:
+        backend = type(caches[alias])
+        if backend.__dict__.get("_profiled"):
+            continue
+        backend.get = profiled_get(backend.get)
+        backend.get_many = profiled_get_many(backend.get_many)
+        backend._profiled = True
+
+
+class Watchdog(threading.Thread):
+    """Takes the stack of requests that run past PROFILING_SLOW_MS."""
+
+    def __init__(self):
+        super().__init__(name="profiling-watchdog", daemon=True)
+        self.lock = threading.Lock()
+        self.active = {}
+
+    def watch(self, profile):
+        with self.lock:
+            self.active[id(profile)] = profile
+
+    def unwatch(self, profile):
+        with self.lock:
+            self.active.pop(id(profile), None)
+
+    def run(self):
+        while True:
+            # Read on every pass, as the thread outlives changes to settings
+            slow = settings.PROFILING_SLOW_MS / 1000
+            time.sleep(max(slow / 4, 0.01))
+            with self.lock:
+                late = [
+                    profile
+                    for profile in self.active.values()
+                    if profile.stack is None and profile.elapsed() > slow
+                ]
+            if not late:
+                continue
+            frames = sys._current_frames()
+            for profile in late:
+                frame = frames.get(profile.thread_id)
+                if frame is not None:
+                    profile.stack = "".join(traceback.format_stack(frame))
+
+
+class Metrics:
+    """Per-view totals of the requests this process served."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.buckets = defaultdict(lambda: [0] * len(BUCKETS))
+        self.totals = defaultdict(Counter)
+
+    def observe(self, view, method, status, profile):
+        with self.lock:
+            self.requests[(view, method, str(status))] += 1
+            buckets = self.buckets[view]
+            for index, bound in enumerate(BUCKETS):
+                if profile.wall <= bound:
+                    buckets[index] += 1
+            totals = self.totals[view]
+            totals["count"] += 1
+            totals["seconds"] += profile.wall
+            totals["db_seconds"] += profile.db_time
+            totals["queries"] += profile.queries
+            totals["duplicate_queries"] += profile.duplicate_queries
+            totals["cache_hits"] += profile.cache_hits
+            totals["cache_misses"] += profile.cache_misses
+            totals["serialization_seconds"] += sum(profile.sections.values())
+
+    def exposition(self):
+        """The metrics in the Prometheus text exposition format."""
+        with self.lock:
+            requests = dict(self.requests)
+            buckets = {view: list(counts) for view, counts in self.buckets.items()}
+            totals = {view: Counter(counts) for view, counts in self.totals.items()}
+
+        lines = [
+            "# HELP http_requests_total Requests served, by view, method and status.",
+            "# TYPE http_requests_total counter",
+        ]
+        for (view, method, status), count in sorted(requests.items()):
+            lines.append(
+                f"http_requests_total{labels(view=view, method=method, status=status)}"
+                f" {count}"
+            )
+        lines += [
+            "# HELP http_request_duration_seconds Wall time of requests.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for view, counts in sorted(buckets.items()):
+            for bound, count in zip(BUCKETS, counts):
+                lines.append(
+                    "http_request_duration_seconds_bucket"
+                    f"{labels(view=view, le=str(bound))} {count}"
+                )
+            lines += [
+                "http_request_duration_seconds_bucket"
+                f"{labels(view=view, le='+Inf')} {totals[view]['count']}",
+                f"http_request_duration_seconds_sum{labels(view=view)} "
+                f"{totals[view]['seconds']:.6f}",
+                f"http_request_duration_seconds_count{labels(view=view)} "
+                f"{totals[view]['count']}",
+            ]
+        for name, key, description in (
+            ("db_query_seconds_total", "db_seconds", "Time spent in SQL queries."),
+            ("db_queries_total", "queries", "SQL queries run."),
+            (
+                "db_duplicate_queries_total",
+                "duplicate_queries",
+                "SQL queries repeating an earlier one of the same request.",
+            ),
+            ("cache_hits_total", "cache_hits", "Cache lookups that found a value."),
+            ("cache_misses_total", "cache_misses", "Cache lookups that did not."),
+            (
+                "serialization_seconds_total",
+                "serialization_seconds",
+                "Time spent serializing and rendering responses.",
+            ),
+        ):
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+            for view, counts in sorted(totals.items()):
+                lines.append(f"{name}{labels(view=view)} {counts[key]}")
+        return "\n".join(lines) + "\n"
+
+
+def labels(**values):
+    def escape(value):
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in values.items()) + "}"
+
+
+metrics_registry = Metrics()
+watchdog = Watchdog()
+
+
+def view_name(request):
+    match = getattr(request, "resolver_match", None)
+    return (match.view_name or match.route) if match else "unmatched"
+
+
+def top_functions(sampler):
+    stream = io.StringIO()
+    stats = pstats.Stats(sampler, stream=stream)
+    stats.sort_stats("cumulative").print_stats(PROFILE_LINES)
+    return stream.getvalue()
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        instrument_caches()
+        if not watchdog.is_alive():
+            watchdog.start()
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        token = current.set(profile)
+        sampler = None
+        if random.random() < settings.PROFILING_SAMPLE_RATE:
+            sampler = cProfile.Profile()
+        watchdog.watch(profile)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile.execute))
+                if sampler:
+                    sampler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if sampler:
+                        sampler.disable()
+        finally:
+            watchdog.unwatch(profile)
+            current.reset(token)
+        profile.wall = profile.elapsed()
+
+        view = view_name(request)
+        response["Server-Timing"] = profile.server_timing()
+        metrics_registry.observe(view, request.method, response.status_code, profile)
+
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "view": view,
+            "status": response.status_code,
+            **profile.as_dict(),
+        }
+        if profile.wall * 1000 < settings.PROFILING_SLOW_MS:
+            logger.info(json.dumps(record))
+            return response
+        if profile.stack:
+            record["stack"] = profile.stack
+        if sampler:
+            record["profile"] = top_functions(sampler)
+        logger.warning(json.dumps(record))
+        return response
+
+    def process_template_response(self, request, response):
+        # Called last, just before the response is rendered
+        profile = current.get()
+        if profile is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                profile.sections["render"] += time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
+
+
+def may_read_metrics(request):
+    token = settings.PROFILING_METRICS_TOKEN
+    if token and constant_time_compare(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        return True
+    try:
+        authenticated = JWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return False
+    user = authenticated[0] if authenticated else request.user
+    return user.is_staff
+
+
+def metrics(request):
+    if not settings.PROFILING_ENABLED:
+        raise Http404
+    if not may_read_metrics(request):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        metrics_registry.exposition(), content_type=METRICS_CONTENT_TYPE
+    )
@@ -0,0 +1,100 @@
+"""
+Per-viewer cache of the posts an account has favorited or reposted and the
+accounts it follows.
+
+Serialization and profile views answer their viewer flags with membership
+checks against these sets instead of one query per page. Each set is cached
+under the version stamp of its relation (see social.versions), and the
+toggles in Post.post and Follow.post bump that stamp once their transaction
+commits. Sets larger than RELATIONS_CACHE_MAX_SIZE are not cached; checks
+against them go to the database, restricted to the ids being asked about.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from social import models, versions
+
+FAVORITES = "favorites"
+REPOSTS = "reposts"
+FOLLOWING = "following"
+
+# Relation kind -> (model, owner field, related id field)
+RELATIONS = {
+    FAVORITES: (models.Favorite, "account_id", "post_id"),
+    REPOSTS: (models.Repost, "account_id", "original_post_id"),
+    FOLLOWING: (models.Follow, "follower_id", "following_id"),
+}
+
+# Cached in place of a set that is too large to be worth holding
+TOO_LARGE = "too-large"
+
+
+def relation_queryset(kind, account_id, ids=None):
+    """The related ids of one kind straight from the database."""
+    model, owner_field, target_field = RELATIONS[kind]
+    queryset = model.objects.filter(**{owner_field: account_id})
+    if ids is not None:
+        queryset = queryset.filter(**{f"{target_field}__in": ids})
+    return queryset.values_list(target_field, flat=True)
+
+
+def cache_key(kind, account_id):
+    # Holds (version stamp, set)
+    return f"relation-set:{kind}:{account_id}"
+
+
+def load(kind, account_id):
+    limit = settings.RELATIONS_CACHE_MAX_SIZE
+    ids = list(relation_queryset(kind, account_id)[: limit + 1])
+    if len(ids) > limit:
+        return TOO_LARGE
+    return frozenset(ids)
+
+
+def get_many(account_id, kinds):
+    """Fetches several of an account's sets in one cache round trip."""
+    keys = {cache_key(kind, account_id): kind for kind in kinds}
+    scopes = {kind: versions.relations_scope(kind, account_id) for kind in kinds}
+    stamp_keys = {versions.cache_key(scope): kind for kind, scope in scopes.items()}
+    found = cache.get_many([*keys, *stamp_keys])
+    stamps = {stamp_keys[key]: found[key] for key in stamp_keys if key in found}
+    if len(stamps) < len(kinds):
+        missing = {scopes[kind]: kind for kind in kinds if kind not in stamps}
+        for scope, stamp in versions.get_many(missing).items():
+            stamps[missing[scope]] = stamp
+
+    sets = {}
+    loaded = {}
+    for key, kind in keys.items():
+        # A set is only good for the version it was loaded under. The stamp
+        # is read before the set is loaded, so one loaded before a change
+        # committed is stored under the old stamp and never served after it.
+        stamp, related = found.get(key, (None, None))
+        if stamp == stamps[kind]:
+            sets[kind] = related
+        else:
+            sets[kind] = load(kind, account_id)
+            loaded[key] = (stamps[kind], sets[kind])
+    if loaded:
+        cache.set_many(loaded, settings.RELATIONS_CACHE_TTL)
+    return sets
+
+
+def subset(kind, account_id, ids, cached=None):
+    """
+    Returns which of `ids` the account has a relation of this kind with.
+    `cached` may carry a set already fetched with get_many.
+    """
+    related = cached if cached is not None else get_many(account_id, [kind])[kind]
+    if related == TOO_LARGE:
+        return set(relation_queryset(kind, account_id, ids))
+    return related & set(ids)
+
+
+def contains(kind, account_id, target_id):
+    return target_id in subset(kind, account_id, [target_id])
+
+
+def invalidate(kind, account_id):
+    """Outdates an account's cached set once the current transaction commits."""
+    versions.bump(versions.relations_scope(kind, account_id))
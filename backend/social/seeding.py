@@ -0,0 +1,446 @@
+"""
+Synthetic social graphs for load testing, see the seed_data command.
+
+Accounts are numbered, and low numbers are the popular ones. Follows,
+replies, reposts and favorites pick their targets with a power-law skew
+towards low-numbered accounts and the posts they wrote first. How many of
+each an account makes is power-law distributed as well.
+
+The work is cut into fixed chunks of accounts. Each chunk draws from its own
+generator, seeded with (seed, phase, chunk). Users, accounts and posts get
+ids worked out up front from those draws. So a seed always produces the same
+rows, whatever the number of worker processes and the order chunks finish in.
+"""
+
+import contextlib
+import random
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import F
+from social import images, models
+from social.counters import actual_counts, count_subquery
+
+# Shape of the per-account count distribution. Counts are Pareto(ALPHA) - 1
+# times the average, which makes the average come out right.
+ALPHA = 2.0
+# Targets are drawn as lo + (hi - lo) * random() ** SKEW
+SKEW = 3
+# No account makes more than CAP times the average of anything
+CAP = 100
+READ_RATIO = 0.5
+# Ids are looked up at most this many at a time
+LOOKUP_SIZE = 1000
+UPDATE_SIZE = 10_000
+
+TEXT_RATIO = 0.6
+MARKDOWN_RATIO = 0.25
+
+WORDS = (
+    "the a of and to in is it that for on with as was at by this be from "
+    "new post today photo people time day year work good great love life "
+    "world music food city team game night week home friend code coffee "
+    "weekend morning idea thread release update news launch project"
+).split()
+
+
+class Plan:
+    """What a seed_data run creates, small enough to hand to every worker."""
+
+    def __init__(
+        self,
+        seed,
+        accounts,
+        chunk_size,
+        averages,
+        depth,
+        end,
+        days,
+        prefix,
+        password,
+        image,
+        batch_size,
+    ):
+        self.seed = seed
+        self.accounts = accounts
+        self.chunk_size = chunk_size
+        self.averages = averages
+        self.depth = depth
+        self.end = end
+        self.start = self.end - timedelta(days=days)
+        self.prefix = prefix
+        self.password = password
+        self.image = image
+        self.batch_size = batch_size
+
+        self.user_base = next_id(models.User.objects)
+        self.account_base = next_id(models.Account.objects)
+        # First post id of each chunk, per wave of posts and for reposts
+        self.post_bases = {}
+        self.post_ranges = {}
+        next_post = next_id(models.Post.all_objects)
+        for kind in self.post_kinds():
+            bases = []
+            for chunk in self.chunks():
+                bases.append(next_post)
+                next_post += sum(self.counts(kind, chunk))
+            self.post_bases[kind] = bases
+            self.post_ranges[kind] = (bases[0] if bases else next_post, next_post)
+
+    def chunks(self):
+        return range((self.accounts + self.chunk_size - 1) // self.chunk_size)
+
+    def chunk_accounts(self, chunk):
+        start = chunk * self.chunk_size
+        return range(start, min(start + self.chunk_size, self.accounts))
+
+    def post_kinds(self):
+        return [f"wave{k}" for k in range(self.depth + 1)] + ["repost"]
+
+    def phases(self):
+        """In order. Every phase only refers to rows of earlier ones."""
+        waves = [f"wave{k}" for k in range(self.depth + 1)]
+        return ["accounts", "follows", *waves, "repost", "favorites"]
+
+    def average(self, kind):
+        if kind == "wave0":
+            return self.averages["posts"]
+        if kind.startswith("wave"):
+            return self.averages["replies"]
+        if kind == "repost":
+            return self.averages["reposts"]
+        return self.averages[kind]
+
+    def counts(self, kind, chunk):
+        """How many of `kind` each account of the chunk makes."""
+        rng = random.Random(f"{self.seed}:count:{kind}:{chunk}")
+        average = self.average(kind)
+        return [
+            min(int((rng.paretovariate(ALPHA) - 1) * average), average * CAP)
+            for _ in self.chunk_accounts(chunk)
+        ]
+
+    def account_id(self, index):
+        return self.account_base + index
+
+    def timestamp(self, rng):
+        return self.start + (self.end - self.start) * rng.random()
+
+
+def next_id(queryset):
+    last = queryset.order_by("-id").values_list("id", flat=True).first()
+    return (last or 0) + 1
+
+
+def skewed(rng, lo, hi):
+    return lo + int((hi - lo) * rng.random() ** SKEW)
+
+
+def later(rng, when, end):
+    """A moment shortly after `when`, a reaction to it."""
+    return min(when + timedelta(seconds=rng.expovariate(1 / 3600)), end)
+
+
+def sentence(rng, low=4, high=30):
+    words = rng.choices(WORDS, k=rng.randint(low, high))
+    return " ".join(words).capitalize()[:255]
+
+
+def lookup(ids):
+    """{post id: (account id, created_at)} of existing posts."""
+    ids = sorted(set(ids))
+    found = {}
+    for start in range(0, len(ids), LOOKUP_SIZE):
+        rows = models.Post.all_objects.filter(
+            id__in=ids[start : start + LOOKUP_SIZE]
+        ).values_list("id", "account_id", "created_at")
+        found.update(
+            (id, (account_id, created_at)) for id, account_id, created_at in rows
+        )
+    return found
+
+
+def notification(rng, account_id, action_account_id, action, post_id, created_at):
+    return models.Notification(
+        account_id=account_id,
+        action_account_id=action_account_id,
+        action=action,
+        post_id=post_id,
+        created_at=created_at,
+        read=rng.random() < READ_RATIO,
+    )
+
+
+@contextlib.contextmanager
+def explicit_timestamps():
+    """Lets bulk_create keep the created_at values it is given."""
+    fields = [
+        model._meta.get_field("created_at")
+        for model in (models.Account, models.Post, models.Notification)
+    ]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def seed_accounts(plan, chunk, rng):
+    users = []
+    accounts = []
+    for index in plan.chunk_accounts(chunk):
+        joined = plan.timestamp(rng)
+        users.append(
+            models.User(
+                id=plan.user_base + index,
+                username=f"{plan.prefix}{index}",
+                password=plan.password,
+                date_joined=joined,
+            )
+        )
+        accounts.append(
+            models.Account(
+                id=plan.account_id(index),
+                user_id=plan.user_base + index,
+                display_name=f"{sentence(rng, 1, 2)} {index}",
+                created_at=joined,
+            )
+        )
+    models.User.objects.bulk_create(users, batch_size=plan.batch_size)
+    models.Account.objects.bulk_create(accounts, batch_size=plan.batch_size)
+    return len(users) + len(accounts)
+
+
+def seed_follows(plan, chunk, rng):
+    follows = []
+    notifications = []
+    counts = plan.counts("follows", chunk)
+    for index, count in zip(plan.chunk_accounts(chunk), counts):
+        targets = set()
+        for _ in range(count * 2):
+            if len(targets) >= min(count, plan.accounts - 1):
+                break
+            target = skewed(rng, 0, plan.accounts)
+            if target != index:
+                targets.add(target)
+        follower_id = plan.account_id(index)
+        for target in sorted(targets):
+            following_id = plan.account_id(target)
+            follows.append(
+                models.Follow(follower_id=follower_id, following_id=following_id)
+            )
+            notifications.append(
+                notification(
+                    rng,
+                    following_id,
+                    follower_id,
+                    "followed",
+                    None,
+                    plan.timestamp(rng),
+                )
+            )
+    models.Follow.objects.bulk_create(follows, batch_size=plan.batch_size)
+    models.Notification.objects.bulk_create(notifications, batch_size=plan.batch_size)
+    return len(follows) + len(notifications)
+
+
+def seed_wave(plan, kind, chunk, rng):
+    """Top-level posts for wave0, replies to the wave before for the others."""
+    wave = int(kind.removeprefix("wave"))
+    counts = plan.counts(kind, chunk)
+    post_id = plan.post_bases[kind][chunk]
+    authored = []
+    for index, count in zip(plan.chunk_accounts(chunk), counts):
+        for _ in range(count):
+            authored.append((post_id, plan.account_id(index)))
+            post_id += 1
+
+    parents = {}
+    if wave:
+        lo, hi = plan.post_ranges[f"wave{wave - 1}"]
+        if lo == hi:
+            return 0
+        parents = {id: skewed(rng, lo, hi) for id, _ in authored}
+        parent_rows = lookup(parents.values())
+
+    posts = []
+    subtypes = {models.TextPost: [], models.MarkdownPost: [], models.ImagePost: []}
+    notifications = []
+    for id, account_id in authored:
+        reply_to_id = parents.get(id)
+        if reply_to_id is None:
+            created_at = plan.timestamp(rng)
+        else:
+            parent_account_id, parent_created_at = parent_rows[reply_to_id]
+            created_at = later(rng, parent_created_at, plan.end)
+            if parent_account_id != account_id:
+                notifications.append(
+                    notification(
+                        rng, parent_account_id, account_id, "replied", id, created_at
+                    )
+                )
+        posts.append(
+            models.Post(
+                id=id,
+                account_id=account_id,
+                reply_to_id=reply_to_id,
+                created_at=created_at,
+            )
+        )
+        roll = rng.random()
+        if roll < TEXT_RATIO:
+            subtypes[models.TextPost].append(
+                models.TextPost(post_id=id, content=sentence(rng))
+            )
+        elif roll < TEXT_RATIO + MARKDOWN_RATIO:
+            content = f"# {sentence(rng, 2, 6)}\n\n{sentence(rng, 10, 60)}"
+            subtypes[models.MarkdownPost].append(
+                models.MarkdownPost(post_id=id, content=content)
+            )
+        else:
+            subtypes[models.ImagePost].append(
+                models.ImagePost(
+                    post_id=id,
+                    image=plan.image,
+                    caption=sentence(rng, 0, 12),
+                    state=images.READY,
+                )
+            )
+
+    models.Post.objects.bulk_create(posts, batch_size=plan.batch_size)
+    for model, rows in subtypes.items():
+        model.objects.bulk_create(rows, batch_size=plan.batch_size)
+    models.Notification.objects.bulk_create(notifications, batch_size=plan.batch_size)
+    return len(posts) * 2 + len(notifications)
+
+
+def seed_reposts(plan, chunk, rng):
+    lo, hi = plan.post_ranges["wave0"]
+    if lo == hi:
+        return 0
+    counts = plan.counts("repost", chunk)
+    post_id = plan.post_bases["repost"][chunk]
+    picked = []
+    for index, count in zip(plan.chunk_accounts(chunk), counts):
+        originals = {skewed(rng, lo, hi) for _ in range(count)}
+        # Slots of duplicate draws are left unused
+        for slot, original_id in enumerate(sorted(originals)):
+            picked.append((post_id + slot, plan.account_id(index), original_id))
+        post_id += count
+    original_rows = lookup(original_id for _, _, original_id in picked)
+
+    posts = []
+    reposts = []
+    notifications = []
+    for id, account_id, original_id in picked:
+        original_account_id, original_created_at = original_rows[original_id]
+        created_at = later(rng, original_created_at, plan.end)
+        posts.append(models.Post(id=id, account_id=account_id, created_at=created_at))
+        reposts.append(
+            models.Repost(
+                account_id=account_id, post_id=id, original_post_id=original_id
+            )
+        )
+        if original_account_id != account_id:
+            notifications.append(
+                notification(
+                    rng,
+                    original_account_id,
+                    account_id,
+                    "reposted",
+                    original_id,
+                    created_at,
+                )
+            )
+    models.Post.objects.bulk_create(posts, batch_size=plan.batch_size)
+    models.Repost.objects.bulk_create(reposts, batch_size=plan.batch_size)
+    models.Notification.objects.bulk_create(notifications, batch_size=plan.batch_size)
+    return len(posts) + len(reposts) + len(notifications)
+
+
+def seed_favorites(plan, chunk, rng):
+    lo = plan.post_ranges["wave0"][0]
+    hi = plan.post_ranges[f"wave{plan.depth}"][1]
+    if lo == hi:
+        return 0
+    counts = plan.counts("favorites", chunk)
+    picked = []
+    for index, count in zip(plan.chunk_accounts(chunk), counts):
+        targets = {skewed(rng, lo, hi) for _ in range(count)}
+        picked.extend((plan.account_id(index), id) for id in sorted(targets))
+    post_rows = lookup(id for _, id in picked)
+
+    favorites = []
+    notifications = []
+    for account_id, post_id in picked:
+        post_account_id, post_created_at = post_rows[post_id]
+        favorites.append(models.Favorite(account_id=account_id, post_id=post_id))
+        if post_account_id != account_id:
+            notifications.append(
+                notification(
+                    rng,
+                    post_account_id,
+                    account_id,
+                    "favorited",
+                    post_id,
+                    later(rng, post_created_at, plan.end),
+                )
+            )
+    models.Favorite.objects.bulk_create(favorites, batch_size=plan.batch_size)
+    models.Notification.objects.bulk_create(notifications, batch_size=plan.batch_size)
+    return len(favorites) + len(notifications)
+
+
+def seed_chunk(plan, phase, chunk):
+    """Creates one chunk's rows of a phase. Returns how many rows."""
+    rng = random.Random(f"{plan.seed}:{phase}:{chunk}")
+    with explicit_timestamps(), transaction.atomic():
+        if phase == "accounts":
+            return seed_accounts(plan, chunk, rng)
+        if phase == "follows":
+            return seed_follows(plan, chunk, rng)
+        if phase == "repost":
+            return seed_reposts(plan, chunk, rng)
+        if phase == "favorites":
+            return seed_favorites(plan, chunk, rng)
+        return seed_wave(plan, phase, chunk, rng)
+
+
+def finish(plan):
+    """Fills in the denormalized counters and moves the id sequences on."""
+    account_ids = (plan.account_base, plan.account_base + plan.accounts - 1)
+    accounts = models.Account.objects.filter(id__range=account_ids)
+    accounts.update(
+        follower_count=count_subquery(models.Follow.objects, "following"),
+        unread_notification_count=count_subquery(
+            models.Notification.objects.filter(read=False), "account"
+        ),
+    )
+    lo = plan.post_ranges["wave0"][0]
+    hi = plan.post_ranges["repost"][1]
+    for start in range(lo, hi, UPDATE_SIZE):
+        with transaction.atomic():
+            models.Post.all_objects.filter(
+                id__gte=start, id__lt=start + UPDATE_SIZE
+            ).update(**actual_counts())
+
+    # The placeholder image was saved once, every image post holds a reference
+    image_posts = models.ImagePost.objects.filter(post_id__gte=lo, post_id__lt=hi)
+    references = image_posts.count()
+    if references:
+        models.MediaBlob.objects.filter(name=plan.image).update(
+            ref_count=F("ref_count") + references - 1
+        )
+    else:
+        default_storage.delete(plan.image)
+
+    statements = connection.ops.sequence_reset_sql(
+        no_style(), [models.User, models.Account, models.Post]
+    )
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
@@ -0,0 +1,9 @@
+"""Summaries of timing samples, shared by the benchmarks and load commands."""
+
+import math
+
+
+def percentile(samples, fraction):
+    """The nearest-rank percentile of `samples`, with `fraction` from 0 to 1."""
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
@@ -0,0 +1,236 @@
+"""
+Benchmarks of the REST hot paths.
+
+setUpTestData seeds a dataset with the seed_data command. Each scenario is
+then requested BENCHMARK_REPEAT times per page through the test client,
+recording its query count, p50/p99 latency and the peak memory allocated
+while serving it. Memory is traced in a pass of its own, so tracing does not
+slow the timed requests. A scenario fails once it runs more queries than its
+budget in QUERY_BUDGETS. When BENCHMARK_OUTPUT names a file, the results
+of the run are written to it as JSON, to compare across commits.
+
+    python manage.py test social.tests.test_benchmark
+    BENCHMARK_ACCOUNTS=2000 BENCHMARK_OUTPUT=after.json python manage.py test social
+"""
+
+import io
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from social import models
+from social.pagination import NEXT_CURSOR_HEADER
+from social.stats import percentile
+
+ACCOUNTS = int(os.getenv("BENCHMARK_ACCOUNTS", "200"))
+REPEAT = int(os.getenv("BENCHMARK_REPEAT", "20"))
+OUTPUT = os.getenv("BENCHMARK_OUTPUT")
+SEED = int(os.getenv("BENCHMARK_SEED", "0"))
+# How deep paginated scenarios go
+PAGES = 3
+
+# Most queries one request of a scenario may run. The counts do not depend on
+# the size of the dataset, so neither do the budgets.
+QUERY_BUDGETS = {
+    "feed": 6,
+    "feed_anonymous": 6,
+    "following": 8,
+    "post": 6,
+    "replies": 8,
+    "thread": 6,
+    "profile": 10,
+    "profile_info": 5,
+    "notifications": 5,
+    "create_text": 8,
+    "favorite_toggle": 14,
+}
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix="benchmark-media-")
+# Cached entries from other runs describe other rows under the same ids
+BENCHMARK_CACHES = {
+    name: {**options, "KEY_PREFIX": f"benchmark-{uuid.uuid4().hex}"}
+    for name, options in settings.CACHES.items()
+}
+
+
+def git_commit():
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+        )
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CACHES=BENCHMARK_CACHES)
+class HotPathBenchmark(TestCase):
+    results = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        started = time.monotonic()
+        # One worker, as other processes cannot see the test transaction
+        call_command(
+            "seed_data",
+            accounts=ACCOUNTS,
+            seed=SEED,
+            prefix="bench",
+            workers=1,
+            stdout=io.StringIO(),
+        )
+        cls.seed_seconds = time.monotonic() - started
+
+        cls.popular = models.Account.objects.select_related("user").get(
+            user__username="bench0"
+        )
+        cls.author = (
+            models.Account.objects.annotate(post_total=Count("posts"))
+            .select_related("user")
+            .order_by("-post_total", "id")
+            .first()
+        )
+        cls.reader = (
+            models.Account.objects.annotate(follows=Count("following"))
+            .select_related("user")
+            .order_by("-follows", "id")
+            .first()
+        )
+        cls.thread_post = (
+            models.Post.objects.filter(reply_to__isnull=True)
+            .order_by("-reply_count", "id")
+            .first()
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        if not OUTPUT:
+            return
+        report = {
+            "commit": git_commit(),
+            "created_at": timezone.now().isoformat(),
+            "database": connection.vendor,
+            "dataset": {"accounts": ACCOUNTS, "seed": SEED, "repeat": REPEAT},
+            "seed_seconds": round(cls.seed_seconds, 2),
+            "results": cls.results,
+        }
+        with open(OUTPUT, "w") as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+
+    def client_for(self, account):
+        client = APIClient()
+        if account is not None:
+            client.force_authenticate(account.user)
+        return client
+
+    def pages(self, client, url):
+        """The urls of the first PAGES pages of a paginated listing."""
+        urls = [url]
+        separator = "&" if "?" in url else "?"
+        while len(urls) < PAGES:
+            response = client.get(urls[-1])
+            cursor = response.get(NEXT_CURSOR_HEADER)
+            if not cursor:
+                break
+            urls.append(f"{url}{separator}cursor={cursor}")
+        return urls
+
+    def record(self, scenario, page, request):
+        """Times `request()` REPEAT times and checks the scenario's budget."""
+        queries = 0
+        timings = []
+        for _ in range(REPEAT):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = request()
+                timings.append(time.perf_counter() - started)
+            self.assertLess(response.status_code, 400, response.content)
+            queries = max(queries, len(captured))
+
+        tracemalloc.start()
+        request()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        self.results.setdefault(scenario, {})[str(page)] = {
+            "queries": queries,
+            "p50_ms": round(percentile(timings, 0.5) * 1000, 3),
+            "p99_ms": round(percentile(timings, 0.99) * 1000, 3),
+            "peak_kib": round(peak / 1024, 1),
+        }
+        self.assertLessEqual(
+            queries,
+            QUERY_BUDGETS[scenario],
+            f"{scenario} page {page} ran {queries} queries",
+        )
+
+    def benchmark_get(self, scenario, url, account=None):
+        client = self.client_for(account)
+        for page, page_url in enumerate(self.pages(client, url), 1):
+            self.record(scenario, page, lambda: client.get(page_url))
+
+    def test_feed(self):
+        self.benchmark_get("feed", "/api/post", self.reader)
+
+    def test_feed_anonymous(self):
+        self.benchmark_get("feed_anonymous", "/api/post")
+
+    def test_following(self):
+        self.benchmark_get("following", "/api/post?following=true", self.reader)
+
+    def test_post(self):
+        self.benchmark_get("post", f"/api/post?id={self.thread_post.id}", self.reader)
+
+    def test_replies(self):
+        url = f"/api/post?replies={self.thread_post.id}"
+        self.benchmark_get("replies", url, self.reader)
+
+    def test_thread(self):
+        url = f"/api/post/thread?id={self.thread_post.id}"
+        self.benchmark_get("thread", url, self.reader)
+
+    def test_profile(self):
+        url = f"/api/profile?username={self.author.user.username}"
+        self.benchmark_get("profile", url, self.reader)
+
+    def test_profile_info(self):
+        url = f"/api/profile/info?username={self.popular.user.username}"
+        self.benchmark_get("profile_info", url, self.reader)
+
+    def test_notifications(self):
+        self.benchmark_get("notifications", "/api/notification", self.popular)
+
+    def test_create_text(self):
+        client = self.client_for(self.reader)
+        data = {"type": "text", "content": "Benchmark post"}
+        self.record(
+            "create_text", 1, lambda: client.post("/api/post", data, format="json")
+        )
+
+    def test_favorite_toggle(self):
+        # Favorites and unfavorites in turn
+        client = self.client_for(self.reader)
+        data = {"type": "favorite", "post_id": self.thread_post.id}
+        self.record(
+            "favorite_toggle",
+            1,
+            lambda: client.post("/api/post", data, format="json"),
+        )
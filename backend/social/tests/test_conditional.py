@@ -0,0 +1,92 @@
+from django.test import override_settings
+from rest_framework.test import APIClient
+from social import models
+from social.tests.utils import (
+    BehaviourTestCase,
+    client_for,
+    create_account,
+    create_post,
+)
+from social.views import UNREAD_COUNT_HEADER
+
+
+class ConditionalGetTests(BehaviourTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = create_account("author")
+        self.reader = create_account("reader")
+        self.post = create_post(self.author)
+
+    def revalidate(self, client, url):
+        """The status of fetching `url` again with the ETag it answered."""
+        etag = client.get(url)["ETag"]
+        return client.get(url, HTTP_IF_NONE_MATCH=etag).status_code
+
+    def favorite(self, post):
+        # Versions are bumped once the request's transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            client_for(self.reader).post(
+                "/api/post", {"type": "favorite", "post_id": post.id}, format="json"
+            )
+
+    def test_unchanged_post_is_not_modified(self):
+        client = client_for(self.reader)
+        self.assertEqual(self.revalidate(client, f"/api/post?id={self.post.id}"), 304)
+
+    def test_favorite_changes_the_post(self):
+        client = client_for(self.reader)
+        url = f"/api/post?id={self.post.id}"
+        etag = client.get(url)["ETag"]
+        self.favorite(self.post)
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["favorite_count"], 1)
+
+    @override_settings(FEED_CACHE_TTL=60)
+    def test_favorite_changes_the_cached_logged_out_post(self):
+        client = APIClient()
+        url = f"/api/post?id={self.post.id}"
+        etag = client.get(url)["ETag"]
+        self.favorite(self.post)
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["favorite_count"], 1)
+        self.assertEqual(self.revalidate(client, url), 304)
+
+    def test_unchanged_profile_is_not_modified(self):
+        client = client_for(self.reader)
+        self.assertEqual(
+            self.revalidate(client, "/api/profile/info?username=author"), 304
+        )
+
+    def test_follow_changes_the_profile(self):
+        client = client_for(self.reader)
+        url = "/api/profile/info?username=author"
+        etag = client.get(url)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            client.post("/api/follow", {"username": "author"}, format="json")
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_unchanged_notifications_are_not_modified(self):
+        self.favorite(self.post)
+        client = client_for(self.author)
+        self.assertEqual(self.revalidate(client, "/api/notification"), 304)
+
+    def test_deleting_a_post_changes_its_notifications(self):
+        # Another notification from the same account stays on the page
+        client_for(self.reader).post(
+            "/api/follow", {"username": "author"}, format="json"
+        )
+        self.favorite(self.post)
+        client = client_for(self.author)
+        etag = client.get("/api/notification")["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            client.delete(f"/api/post?id={self.post.id}")
+
+        response = client.get("/api/notification", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([n["action"] for n in response.json()], ["followed"])
+        self.assertEqual(response[UNREAD_COUNT_HEADER], "1")
+        author = models.Account.objects.get(id=self.author.id)
+        self.assertEqual(author.unread_notification_count, 1)
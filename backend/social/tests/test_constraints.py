@@ -0,0 +1,58 @@
+import io
+
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from social import models
+from social.tests.utils import (
+    BehaviourTestCase,
+    client_for,
+    create_account,
+    create_post,
+    repost,
+)
+
+
+class DuplicateRelationTests(BehaviourTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = create_account("author")
+        self.reader = create_account("reader")
+        self.post = create_post(self.author)
+
+    def assertDuplicateRejected(self, model, **fields):
+        model.objects.create(**fields)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            model.objects.create(**fields)
+
+    def test_follow_pairs_are_unique(self):
+        self.assertDuplicateRejected(
+            models.Follow, follower=self.reader, following=self.author
+        )
+
+    def test_favorite_pairs_are_unique(self):
+        self.assertDuplicateRejected(
+            models.Favorite, account=self.reader, post=self.post
+        )
+
+    def test_repost_pairs_are_unique(self):
+        self.assertDuplicateRejected(
+            models.Repost, account=self.reader, original_post=self.post
+        )
+
+    def test_reposting_twice_toggles(self):
+        repost(self.reader, self.post)
+        repost(self.reader, self.post)
+        self.assertFalse(models.Repost.objects.exists())
+
+    def test_remove_duplicate_relations_keeps_unique_rows(self):
+        client_for(self.reader).post(
+            "/api/follow", {"username": "author"}, format="json"
+        )
+        client_for(self.reader).post(
+            "/api/post", {"type": "favorite", "post_id": self.post.id}, format="json"
+        )
+        output = io.StringIO()
+        call_command("remove_duplicate_relations", stdout=output)
+        self.assertIn("Found 0 duplicate rows", output.getvalue())
+        self.assertEqual(models.Follow.objects.count(), 1)
+        self.assertEqual(models.Favorite.objects.count(), 1)
@@ -0,0 +1,116 @@
+import io
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from social import models
+from social.tests.utils import (
+    BehaviourTestCase,
+    client_for,
+    create_account,
+    create_post,
+    refresh,
+    repost,
+)
+
+
+class PostCounterTests(BehaviourTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = create_account("author")
+        self.reader = create_account("reader")
+        self.post = create_post(self.author)
+
+    def favorite(self):
+        client_for(self.reader).post(
+            "/api/post", {"type": "favorite", "post_id": self.post.id}, format="json"
+        )
+
+    def test_favorite_toggles_the_count(self):
+        self.favorite()
+        self.assertEqual(refresh(self.post).favorite_count, 1)
+        self.favorite()
+        self.assertEqual(refresh(self.post).favorite_count, 0)
+
+    def test_unfavorite_that_lost_a_race_does_not_uncount(self):
+        self.favorite()
+        # Another request removed the favorite between the lookup and delete
+        with mock.patch.object(models.Favorite, "delete", return_value=(0, {})):
+            self.favorite()
+        self.assertEqual(refresh(self.post).favorite_count, 1)
+
+    def test_reply_counts_and_uncounts(self):
+        reply = create_post(self.reader, reply_to=self.post)
+        self.assertEqual(refresh(self.post).reply_count, 1)
+        client_for(self.reader).delete(f"/api/post?id={reply.id}")
+        self.assertEqual(refresh(self.post).reply_count, 0)
+
+    def test_repost_toggles_the_count(self):
+        repost(self.reader, self.post)
+        self.assertEqual(refresh(self.post).repost_count, 1)
+        repost(self.reader, self.post)
+        self.assertEqual(refresh(self.post).repost_count, 0)
+        self.assertFalse(models.Post.objects.filter(account=self.reader).exists())
+
+    def test_deleting_the_repost_undoes_it(self):
+        repost(create_account("other"), self.post)
+        repost(self.reader, self.post)
+        wrapper = models.Repost.objects.get(
+            original_post=self.post, account=self.reader
+        ).post
+        client = client_for(self.reader)
+        with self.captureOnCommitCallbacks(execute=True):
+            client.delete(f"/api/post?id={wrapper.id}")
+        self.assertEqual(refresh(self.post).repost_count, 1)
+        self.assertFalse(models.Repost.objects.filter(account=self.reader).exists())
+        self.assertFalse(client.get(f"/api/post?id={self.post.id}").json()["reposted"])
+
+        response = repost(self.reader, self.post)
+        self.assertEqual(response.json(), {"message": "Post created successfully"})
+        self.assertEqual(refresh(self.post).repost_count, 2)
+
+    def test_rebuild_matches_counts_with_hidden_reposts(self):
+        parent = create_post(self.reader)
+        client_for(self.reader).post(
+            "/api/post",
+            {"type": "repost", "post_id": self.post.id, "reply_id": parent.id},
+            format="json",
+        )
+        client_for(self.reader).delete(f"/api/post?id={parent.id}")
+        out = io.StringIO()
+        call_command("rebuild_post_counters", dry_run=True, stdout=out)
+        self.assertIn("Found 0 with drifted counters", out.getvalue())
+
+    def test_counts_are_served(self):
+        self.favorite()
+        repost(self.reader, self.post)
+        create_post(self.reader, reply_to=self.post)
+        data = client_for(self.reader).get(f"/api/post?id={self.post.id}").json()
+        self.assertEqual(data["favorite_count"], 1)
+        self.assertEqual(data["repost_count"], 1)
+        self.assertEqual(refresh(self.post).reply_count, 1)
+
+
+class AccountCounterTests(BehaviourTestCase):
+    def test_follow_counts_and_uncounts(self):
+        author = create_account("author")
+        client = client_for(create_account("reader"))
+        client.post("/api/follow", {"username": "author"}, format="json")
+        self.assertEqual(models.Account.objects.get(id=author.id).follower_count, 1)
+        client.post("/api/follow", {"username": "author"}, format="json")
+        self.assertEqual(models.Account.objects.get(id=author.id).follower_count, 0)
+
+    def test_profile_update_leaves_the_counters_alone(self):
+        author = create_account("author")
+        with CaptureQueriesContext(connection) as captured:
+            client_for(author).post(
+                "/api/profile/info",
+                {"username": "author", "type": "display_name", "display_name": "A"},
+                format="json",
+            )
+        updates = [q["sql"] for q in captured if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.assertIn("display_name", updates[0])
+        self.assertNotIn("follower_count", updates[0])
+        self.assertNotIn("unread_notification_count", updates[0])
@@ -0,0 +1,126 @@
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from social import deletion, models
+from social.pagination import NEXT_CURSOR_HEADER, PAGE_SIZE
+from social.tests.utils import (
+    BehaviourTestCase,
+    client_for,
+    create_account,
+    create_post,
+    refresh,
+    repost,
+)
+
+
+class SoftDeleteTests(BehaviourTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = create_account("author")
+        self.reader = create_account("reader")
+        self.post = create_post(self.author)
+        self.reply = create_post(self.reader, reply_to=self.post)
+        self.nested = create_post(self.author, reply_to=self.reply)
+
+    def delete(self, post):
+        return client_for(post.account).delete(f"/api/post?id={post.id}")
+
+    def test_hides_the_reply_tree(self):
+        self.delete(self.post)
+        for post in (self.post, self.reply, self.nested):
+            self.assertIsNotNone(refresh(post).deleted_at)
+        self.assertFalse(models.Post.objects.exists())
+
+    def test_deleting_a_reply_updates_the_parent(self):
+        self.delete(self.reply)
+        self.assertEqual(refresh(self.post).reply_count, 0)
+        self.assertIsNone(refresh(self.post).deleted_at)
+        self.assertIsNotNone(refresh(self.nested).deleted_at)
+
+    def test_hides_reposts_of_the_post(self):
+        repost(self.reader, self.post)
+        wrapper = models.Repost.objects.get(original_post=self.post).post
+        self.delete(self.post)
+        self.assertIsNotNone(refresh(wrapper).deleted_at)
+
+    def test_hiding_a_repost_reply_updates_its_parent(self):
+        other = create_post(self.reader)
+        client_for(self.author).post(
+            "/api/post",
+            {"type": "repost", "post_id": self.post.id, "reply_id": other.id},
+            format="json",
+        )
+        self.assertEqual(refresh(other).reply_count, 1)
+        self.delete(self.post)
+        self.assertEqual(refresh(other).reply_count, 0)
+
+    def test_hiding_a_repost_reply_uncounts_the_repost(self):
+        other = create_post(self.reader)
+        client_for(self.author).post(
+            "/api/post",
+            {"type": "repost", "post_id": other.id, "reply_id": self.post.id},
+            format="json",
+        )
+        self.assertEqual(refresh(other).repost_count, 1)
+        self.delete(self.post)
+        self.assertEqual(refresh(other).repost_count, 0)
+
+    def test_reaps_everything_hidden(self):
+        repost(self.reader, self.post)
+        self.delete(self.post)
+        while deletion.reap_batch():
+            pass
+        self.assertFalse(models.Post.all_objects.exists())
+        self.assertFalse(models.Repost.objects.exists())
+        self.assertFalse(models.TextPost.objects.exists())
+        self.assertFalse(models.Notification.objects.exists())
+        author = models.Account.objects.get(id=self.author.id)
+        self.assertEqual(author.unread_notification_count, 0)
+
+    def test_hides_replies_and_reposts_written_during_the_delete(self):
+        repost(self.reader, self.post)
+        wrapper = models.Repost.objects.get(original_post=self.post).post
+        # Only the post itself was stamped when they came in
+        models.Post.objects.filter(id=self.post.id).update(
+            deleted_at=self.post.created_at
+        )
+        deletion.hide_orphans()
+        self.assertIsNotNone(refresh(self.reply).deleted_at)
+        self.assertIsNotNone(refresh(wrapper).deleted_at)
+
+    def test_idle_reaper_does_not_look_for_orphans(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(deletion.hide_orphans(), 0)
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0]["sql"].startswith("SELECT"))
+
+    def test_looks_for_orphans_only_below_deleted_posts(self):
+        self.delete(self.post)
+        with CaptureQueriesContext(connection) as queries:
+            deletion.hide_orphans()
+        for query in queries.captured_queries:
+            if query["sql"].startswith("UPDATE"):
+                self.assertIn(" IN (SELECT ", query["sql"])
+                self.assertNotIn(" OR ", query["sql"])
+
+
+@override_settings(TIMELINE_ENABLED=True)
+class DeletedTimelinePostTests(BehaviourTestCase):
+    def test_following_feed_pages_past_deleted_posts(self):
+        author = create_account("author")
+        reader = create_account("reader")
+        client = client_for(reader)
+        client.post("/api/follow", {"username": "author"}, format="json")
+        posts = [create_post(author, f"Post {i}") for i in range(PAGE_SIZE + 4)]
+        client_for(author).delete(f"/api/post?id={posts[-2].id}")
+
+        seen = []
+        url = "/api/post?following=true"
+        while url:
+            response = client.get(url)
+            seen += [post["id"] for post in response.json()]
+            cursor = response.get(NEXT_CURSOR_HEADER)
+            url = cursor and f"/api/post?following=true&cursor={cursor}"
+
+        expected = [post.id for post in reversed(posts) if post != posts[-2]]
+        self.assertEqual(seen, expected)
@@ -0,0 +1,165 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock
+
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils import timezone
+from PIL import Image as PILImage
+from rest_framework.test import APIClient
+from social import images, models
+from social.management.commands import restructure_images
+from social.management.commands.process_images import Command as ProcessImages
+from social.tests.utils import BehaviourTestCase, create_account
+
+
+def rendered_mode(img):
+    file = io.BytesIO()
+    img.save(file, "PNG")
+    file.seek(0)
+    data = images.render_variants(file, ["avatar"])["avatar"]
+    with PILImage.open(io.BytesIO(data)) as variant:
+        return variant.mode
+
+
+class RenderVariantsTests(BehaviourTestCase):
+    def test_keeps_the_alpha_of_grayscale_images(self):
+        self.assertEqual(rendered_mode(PILImage.new("LA", (8, 8), (0, 0))), "RGBA")
+
+    def test_keeps_the_transparent_color_of_palette_images(self):
+        img = PILImage.new("P", (8, 8), 0)
+        img.info["transparency"] = 0
+        self.assertEqual(rendered_mode(img), "RGBA")
+
+    def test_opaque_images_stay_opaque(self):
+        self.assertEqual(rendered_mode(PILImage.new("L", (8, 8), 0)), "RGB")
+        self.assertEqual(rendered_mode(PILImage.new("P", (8, 8), 0)), "RGB")
+
+
+class BackfillTests(BehaviourTestCase):
+    def image_post(self, state, age):
+        post = models.Post.objects.create(account=self.account)
+        models.Post.objects.filter(id=post.id).update(created_at=timezone.now() - age)
+        return models.ImagePost.objects.create(
+            post=post, image=f"posts/{post.id}.png", caption="", state=state
+        )
+
+    def test_picks_up_image_posts_left_pending(self):
+        self.account = create_account("author")
+        lost = self.image_post(images.PENDING, timedelta(hours=1))
+        claimed = self.image_post(images.PROCESSING, timedelta(hours=1))
+        self.image_post(images.PENDING, timedelta(seconds=1))
+        self.image_post(images.FAILED, timedelta(hours=1))
+
+        labels = [label for label, _, _ in ProcessImages().backfill_jobs(300)]
+        self.assertCountEqual(
+            labels, [f"image post {lost.id}", f"image post {claimed.id}"]
+        )
+
+
+class AccountPictureTests(BehaviourTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp(prefix="picture-tests-")
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.account = create_account("author")
+        self.set_picture("first.png")
+
+    def set_picture(self, name):
+        models.Account.objects.filter(id=self.account.id).update(
+            profile_picture=name, profile_picture_state=images.PENDING
+        )
+
+    def reload(self):
+        return models.Account.objects.get(id=self.account.id)
+
+    def finish(self, name, result):
+        images.finish_account_picture(self.account.id, "profile_picture", name, result)
+
+    def rendered(self):
+        return {"avatar": b"webp"}
+
+    def failed(self):
+        raise images.InvalidImage("first.png")
+
+    def test_rendered_picture_gets_its_variants(self):
+        self.finish("first.png", self.rendered)
+        account = self.reload()
+        self.assertEqual(list(account.profile_picture_variants), ["avatar"])
+        self.assertEqual(account.profile_picture_state, images.READY)
+
+    def test_job_for_a_replaced_picture_changes_nothing(self):
+        self.set_picture("second.png")
+        self.finish("first.png", self.rendered)
+        self.finish("first.png", self.failed)
+        account = self.reload()
+        self.assertEqual(account.profile_picture.name, "second.png")
+        self.assertEqual(account.profile_picture_variants, {})
+        self.assertEqual(account.profile_picture_state, images.PENDING)
+
+    def test_invalid_picture_is_dropped(self):
+        self.finish("first.png", self.failed)
+        account = self.reload()
+        self.assertFalse(account.profile_picture)
+        self.assertEqual(account.profile_picture_state, images.FAILED)
+
+    def test_original_is_never_served(self):
+        url = "/api/profile/info?username=author"
+        self.assertIsNone(APIClient().get(url).json()["profile_picture"])
+        self.finish("first.png", self.rendered)
+        avatar = self.reload().profile_picture_variants["avatar"]
+        served = APIClient().get(url).json()["profile_picture"]
+        self.assertEqual(served, default_storage.url(avatar))
+
+    def test_queue_worker_claims_pending_pictures(self):
+        jobs = ProcessImages().claim_pending(10)
+        self.assertEqual([label for label, _, _ in jobs], ["profile_picture of author"])
+        self.assertEqual(self.reload().profile_picture_state, images.PROCESSING)
+        self.assertEqual(ProcessImages().claim_pending(10), [])
+
+
+class RestructureImagesTests(BehaviourTestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp(prefix="restructure-tests-")
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.account = create_account("author")
+
+    def image_post(self, name, data):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        post = models.Post.objects.create(account=self.account)
+        return models.ImagePost.objects.create(
+            post=post, image=name, caption="", state=images.READY
+        )
+
+    def test_files_with_the_same_name_in_a_chunk_are_both_kept(self):
+        posts = [
+            self.image_post(f"{folder}/pic.png", folder.encode()) for folder in "ab"
+        ]
+        move = shutil.move
+        both_checked = threading.Barrier(2, timeout=5)
+
+        def move_together(src, dst):
+            # Both workers have picked a destination before either moves
+            both_checked.wait()
+            return move(src, dst)
+
+        with override_settings(MEDIA_ROOT=self.media_root), mock.patch.object(
+            restructure_images.shutil, "move", side_effect=move_together
+        ):
+            call_command("restructure_images", workers=2, stdout=io.StringIO())
+
+        names = [str(models.ImagePost.objects.get(id=post.id).image) for post in posts]
+        self.assertEqual(len(set(names)), 2)
+        for name, data in zip(names, [b"a", b"b"]):
+            with open(os.path.join(self.media_root, name), "rb") as f:
+                self.assertEqual(f.read(), data)
@@ -0,0 +1,60 @@
+import shutil
+import tempfile
+
+from django.core.files.base import ContentFile
+from social import models
+from social.media import ContentAddressedStorage
+from social.tests.utils import BehaviourTestCase
+
+
+class ContentAddressedStorageTests(BehaviourTestCase):
+    def setUp(self):
+        super().setUp()
+        location = tempfile.mkdtemp(prefix="media-tests-")
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        self.storage = ContentAddressedStorage(location=location)
+
+    def save(self, data=b"same bytes"):
+        return self.storage.save("upload.png", ContentFile(data))
+
+    def ref_count(self, name):
+        blob = models.MediaBlob.objects.filter(name=name).first()
+        return blob.ref_count if blob else None
+
+    def delete(self, name):
+        # The file goes once the deleting transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            self.storage.delete(name)
+
+    def test_identical_uploads_share_a_blob(self):
+        first = self.save()
+        second = self.save()
+        self.assertEqual(first, second)
+        self.assertEqual(self.ref_count(first), 2)
+        self.assertNotEqual(self.save(b"other bytes"), first)
+
+    def test_file_goes_with_the_last_reference(self):
+        name = self.save()
+        self.save()
+        self.delete(name)
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(self.ref_count(name), 1)
+        self.delete(name)
+        self.assertFalse(self.storage.exists(name))
+        self.assertIsNone(self.ref_count(name))
+
+    def test_upload_before_the_delete_commits_keeps_the_file(self):
+        name = self.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.storage.delete(name)
+            # The same bytes uploaded again before the deletion ran
+            self.assertEqual(self.save(), name)
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(self.ref_count(name), 1)
+
+    def test_upload_after_the_delete_writes_the_file_again(self):
+        name = self.save()
+        self.delete(name)
+        self.assertEqual(self.save(), name)
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(self.ref_count(name), 1)
@@ -0,0 +1,58 @@
+from social import models
+from social.tests.utils import BehaviourTestCase, client_for, create_account
+from social.views import UNREAD_COUNT_HEADER
+
+
+class UnreadCountTests(BehaviourTestCase):
+    def setUp(self):
+        super().setUp()
+        self.account = create_account("account")
+        self.other = create_account("other")
+        self.client = client_for(self.account)
+        self.notifications = [
+            models.Notification.objects.create(
+                account=self.account, action="followed", action_account=self.other
+            )
+            for _ in range(3)
+        ]
+
+    def unread_count(self):
+        return models.Account.objects.get(id=self.account.id).unread_notification_count
+
+    def mark(self, **data):
+        return self.client.post("/api/notification", data, format="json")
+
+    def test_new_notifications_are_counted(self):
+        self.assertEqual(self.unread_count(), 3)
+        response = self.client.get("/api/notification")
+        self.assertEqual(response[UNREAD_COUNT_HEADER], "3")
+
+    def test_read_one(self):
+        notification = self.notifications[0]
+        self.mark(type="read", notification_id=notification.id)
+        self.mark(type="read", notification_id=notification.id)
+        self.assertEqual(self.unread_count(), 2)
+
+    def test_read_all(self):
+        self.mark(type="all")
+        self.assertEqual(self.unread_count(), 0)
+        self.assertFalse(models.Notification.objects.filter(read=False).exists())
+
+    def test_read_all_up_to_leaves_newer_ones_unread(self):
+        self.mark(type="all", up_to=self.notifications[1].id)
+        self.assertEqual(self.unread_count(), 1)
+        self.assertFalse(
+            models.Notification.objects.get(id=self.notifications[2].id).read
+        )
+
+    def test_read_all_takes_off_only_what_it_marked(self):
+        self.mark(type="read", notification_id=self.notifications[0].id)
+        # Counted by a notification committed while the request ran
+        models.adjust_unread_count(self.account.id, 1)
+        self.mark(type="all")
+        self.assertEqual(self.unread_count(), 1)
+
+    def test_invalid_up_to_is_rejected(self):
+        response = self.mark(type="all", up_to="latest")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.unread_count(), 3)
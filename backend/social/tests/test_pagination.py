@@ -0,0 +1,81 @@
+from social import models
+from social.pagination import NEXT_CURSOR_HEADER, PAGE_SIZE, Cursor
+from social.tests.utils import (
+    BehaviourTestCase,
+    client_for,
+    create_account,
+    create_post,
+)
+
+
+class CursorPaginationTests(BehaviourTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = create_account("author")
+        self.client = client_for(self.author)
+
+    def pages(self, url, key="id"):
+        """The ids of every page of `url`, page by page."""
+        pages = []
+        separator = "&" if "?" in url else "?"
+        next_url = url
+        while next_url:
+            response = self.client.get(next_url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([item[key] for item in response.json()])
+            cursor = response.get(NEXT_CURSOR_HEADER)
+            next_url = cursor and f"{url}{separator}cursor={cursor}"
+        return pages
+
+    def test_pages_cover_every_post_once(self):
+        posts = [create_post(self.author) for _ in range(PAGE_SIZE * 2 + 1)]
+        pages = self.pages("/api/post")
+        self.assertEqual([len(page) for page in pages], [PAGE_SIZE, PAGE_SIZE, 1])
+        self.assertEqual(sum(pages, []), [post.id for post in reversed(posts)])
+
+    def test_posts_sharing_a_timestamp_are_not_skipped(self):
+        posts = [create_post(self.author) for _ in range(PAGE_SIZE + 2)]
+        models.Post.objects.update(created_at=posts[0].created_at)
+        pages = self.pages("/api/profile?username=author")
+        self.assertEqual(sum(pages, []), [post.id for post in reversed(posts)])
+
+    def test_last_full_page_has_no_cursor(self):
+        for _ in range(PAGE_SIZE):
+            create_post(self.author)
+        response = self.client.get("/api/post")
+        self.assertEqual(len(response.json()), PAGE_SIZE)
+        self.assertFalse(response.has_header(NEXT_CURSOR_HEADER))
+
+    def test_replies_are_paginated(self):
+        post = create_post(self.author)
+        reader = create_account("reader")
+        replies = [create_post(reader, reply_to=post) for _ in range(PAGE_SIZE + 1)]
+        pages = self.pages(f"/api/post?replies={post.id}")
+        self.assertEqual(sum(pages, []), [reply.id for reply in reversed(replies)])
+
+    def test_notifications_are_paginated(self):
+        reader = create_account("reader")
+        notifications = [
+            models.Notification.objects.create(
+                account=self.author, action="followed", action_account=reader
+            )
+            for _ in range(PAGE_SIZE + 1)
+        ]
+        pages = self.pages("/api/notification", key="notification_id")
+        self.assertEqual([len(page) for page in pages], [PAGE_SIZE, 1])
+        self.assertEqual(sum(pages, []), [n.id for n in reversed(notifications)])
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get("/api/post?cursor=not-a-cursor")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"message": "Invalid cursor"})
+
+    def test_cursor_bounds_the_index_range(self):
+        post = create_post(self.author)
+        cursor = Cursor(post.created_at, post.id)
+        sql = str(models.Post.all_objects.filter(cursor.filter()).query)
+        where = sql[sql.index(" WHERE ") :]
+        # A top-level bound on created_at, ANDed with the tie-break on id
+        self.assertRegex(
+            where, r'^ WHERE \("social_post"\."created_at" <= [^()]* AND \(.* OR '
+        )
@@ -0,0 +1,28 @@
+from django.test import override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from social.tests.utils import BehaviourTestCase, create_account
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_METRICS_TOKEN="scraper-token")
+class MetricsAccessTests(BehaviourTestCase):
+    def get(self, authorization=None):
+        headers = {"Authorization": authorization} if authorization else {}
+        return APIClient().get("/api/metrics", headers=headers).status_code
+
+    def bearer(self, username, is_staff=False):
+        user = create_account(username).user
+        user.is_staff = is_staff
+        user.save()
+        return f"Bearer {AccessToken.for_user(user)}"
+
+    def test_anonymous_and_regular_users_are_refused(self):
+        self.assertEqual(self.get(), 403)
+        self.assertEqual(self.get(self.bearer("reader")), 403)
+
+    def test_staff_users_are_served(self):
+        self.assertEqual(self.get(self.bearer("admin", is_staff=True)), 200)
+
+    def test_scraper_token_is_served(self):
+        self.assertEqual(self.get("Bearer scraper-token"), 200)
+        self.assertEqual(self.get("Bearer wrong"), 403)
@@ -0,0 +1,53 @@
+from unittest import mock
+
+from social import relations
+from social.tests.utils import (
+    BehaviourTestCase,
+    client_for,
+    create_account,
+    create_post,
+)
+
+
+class RelationCacheTests(BehaviourTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = create_account("author")
+        self.reader = create_account("reader")
+        self.post = create_post(self.author)
+
+    def favorite(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            client_for(self.reader).post(
+                "/api/post",
+                {"type": "favorite", "post_id": self.post.id},
+                format="json",
+            )
+
+    def favorited(self):
+        return relations.contains(relations.FAVORITES, self.reader.id, self.post.id)
+
+    def test_toggles_outdate_the_cached_set(self):
+        self.assertFalse(self.favorited())
+        self.favorite()
+        self.assertTrue(self.favorited())
+        self.favorite()
+        self.assertFalse(self.favorited())
+
+    def test_set_loaded_before_a_change_is_not_served_after_it(self):
+        load = relations.load
+
+        def load_then_favorite(kind, account_id):
+            loaded = load(kind, account_id)
+            # The favorite commits after the set was read, before it is cached
+            self.favorite()
+            return loaded
+
+        with mock.patch.object(relations, "load", side_effect=load_then_favorite):
+            self.assertFalse(self.favorited())
+        self.assertTrue(self.favorited())
+
+    def test_cached_set_saves_queries(self):
+        self.favorited()
+        with self.assertNumQueries(0):
+            self.assertFalse(self.favorited())
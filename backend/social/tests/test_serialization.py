@@ -0,0 +1,63 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from social import models
+from social.tests.utils import (
+    BehaviourTestCase,
+    client_for,
+    create_account,
+    create_post,
+    repost,
+)
+from social.views import post_queryset, serialize_posts
+
+
+class SerializePostsTests(BehaviourTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = create_account("author")
+        self.reader = create_account("reader")
+
+    def reply_chain(self, depth):
+        post = create_post(self.author)
+        for _ in range(depth):
+            post = create_post(self.reader, reply_to=post)
+        return post
+
+    def queries(self, post):
+        def serialize():
+            serialize_posts(post_queryset().filter(id=post.id), self.reader.user)
+
+        # Once with the viewer's relation sets cached
+        serialize()
+        with CaptureQueriesContext(connection) as captured:
+            serialize()
+        return len(captured)
+
+    def test_queries_do_not_grow_with_depth(self):
+        self.assertEqual(
+            self.queries(self.reply_chain(1)), self.queries(self.reply_chain(10))
+        )
+
+    def test_embeds_the_whole_chain(self):
+        root = create_post(self.author, "Root")
+        reply = create_post(self.reader, "Reply", reply_to=root)
+        repost(self.reader, reply)
+        wrapper = models.Repost.objects.get(original_post=reply).post
+
+        data = serialize_posts([wrapper], self.reader.user)[0]
+        self.assertTrue(data["is_repost"])
+        self.assertFalse(data["reposted"])
+        self.assertEqual(data["original_post"]["content"], "Reply")
+        self.assertTrue(data["original_post"]["reposted"])
+        self.assertEqual(data["original_post"]["reply_to"]["content"], "Root")
+        self.assertIsNone(data["original_post"]["reply_to"]["reply_to"])
+
+    def test_deleted_parent_is_embedded_as_none(self):
+        parent = create_post(self.author)
+        reply = create_post(self.reader, reply_to=parent)
+        # Only the parent is hidden yet, as while a delete is being reaped
+        models.Post.objects.filter(id=parent.id).update(deleted_at=parent.created_at)
+
+        response = client_for(self.reader).get(f"/api/post?id={reply.id}")
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json()["reply_to"])
@@ -0,0 +1,70 @@
+from django.test import override_settings
+from social import models
+from social.pagination import NEXT_CURSOR_HEADER
+from social.tests.utils import (
+    BehaviourTestCase,
+    client_for,
+    create_account,
+    create_post,
+)
+
+
+@override_settings(TIMELINE_ENABLED=True)
+class TimelineTests(BehaviourTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = create_account("author")
+        self.reader = create_account("reader")
+        self.client = client_for(self.reader)
+
+    def follow(self, account):
+        self.client.post(
+            "/api/follow", {"username": account.user.username}, format="json"
+        )
+
+    def timeline(self):
+        return list(
+            models.TimelineEntry.objects.filter(account=self.reader)
+            .order_by("-created_at")
+            .values_list("post_id", flat=True)
+        )
+
+    def feed(self):
+        """Post ids of every page of the reader's following feed."""
+        ids = []
+        url = "/api/post?following=true"
+        while url:
+            response = self.client.get(url)
+            ids += [post["id"] for post in response.json()]
+            cursor = response.get(NEXT_CURSOR_HEADER)
+            url = cursor and f"/api/post?following=true&cursor={cursor}"
+        return ids
+
+    def test_new_posts_are_pushed_to_followers(self):
+        self.follow(self.author)
+        post = create_post(self.author)
+        create_post(self.reader, reply_to=post)
+        self.assertEqual(self.timeline(), [post.id])
+        self.assertEqual(self.feed(), [post.id])
+
+    def test_follow_backfills_and_unfollow_removes(self):
+        posts = [create_post(self.author) for _ in range(3)]
+        self.follow(self.author)
+        self.assertEqual(self.timeline(), [post.id for post in reversed(posts)])
+        self.follow(self.author)
+        self.assertEqual(self.timeline(), [])
+        self.assertEqual(self.feed(), [])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_large_accounts_are_merged_on_read(self):
+        self.follow(self.author)
+        post = create_post(self.author)
+        self.assertEqual(self.timeline(), [])
+        self.assertEqual(self.feed(), [post.id])
+
+    @override_settings(TIMELINE_MAX_LENGTH=3, TIMELINE_TRIM_EVERY=1)
+    def test_fan_out_trims_and_reads_past_the_window(self):
+        self.follow(self.author)
+        posts = [create_post(self.author) for _ in range(5)]
+        self.assertEqual(self.timeline(), [post.id for post in posts[:1:-1]])
+        self.assertEqual(self.feed(), [post.id for post in reversed(posts)])
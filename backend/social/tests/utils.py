@@ -0,0 +1,50 @@
+"""Accounts, posts and clients for the behaviour tests."""
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from social import models
+
+TEST_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "social-tests",
+    }
+}
+
+
+@override_settings(CACHES=TEST_CACHES, FEED_CACHE_TTL=0)
+class BehaviourTestCase(TestCase):
+    def setUp(self):
+        # Cached relation sets and versions start out empty in every test
+        cache.clear()
+
+
+def create_account(username):
+    user = User.objects.create_user(username=username, password="password")
+    return models.Account.objects.create(user=user, display_name=username)
+
+
+def client_for(account):
+    client = APIClient()
+    client.force_authenticate(account.user)
+    return client
+
+
+def create_post(account, content="Hello", reply_to=None):
+    """A text post, created through the API as a client would."""
+    data = {"type": "text", "content": content}
+    if reply_to is not None:
+        data["reply_id"] = reply_to.id
+    client_for(account).post("/api/post", data, format="json")
+    return models.Post.objects.filter(account=account).latest("id")
+
+
+def repost(account, post):
+    data = {"type": "repost", "post_id": post.id}
+    return client_for(account).post("/api/post", data, format="json")
+
+
+def refresh(post):
+    return models.Post.all_objects.get(id=post.id)
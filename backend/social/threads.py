@@ -0,0 +1,90 @@
+"""
+Whole conversations around a post, fetched with one recursive query.
+
+A thread is the post, every ancestor up its reply_to chain, and its
+descendants down to a bounded depth. One WITH RECURSIVE query over
+Post.reply_to collects their ids (PostgreSQL and SQLite both support it),
+so a long thread costs the same number of queries as a short one. Pages of
+posts load the parents and repost originals they embed the same way, see
+chain_rows.
+"""
+
+from django.db import connection
+from social import models
+
+DEFAULT_DEPTH = 3
+MAX_DEPTH = 10
+DEFAULT_LIMIT = 200
+MAX_LIMIT = 1000
+
+
+def thread_rows(post_id, depth, limit):
+    """
+    Returns (id, reply_to_id, depth) for the post and all of its ancestors,
+    plus up to `limit` descendants at most `depth` replies below it.
+    Ancestors have negative depths. Descendants are taken shallowest first,
+    so a truncated window never holds a reply without its parent.
+    """
+    table = connection.ops.quote_name(models.Post._meta.db_table)
+    sql = f"""
+        WITH RECURSIVE
+        ancestors(id, reply_to_id, depth) AS (
+            SELECT id, reply_to_id, 0 FROM {table}
+            WHERE id = %s AND deleted_at IS NULL
+            UNION ALL
+            SELECT p.id, p.reply_to_id, a.depth - 1
+            FROM {table} p JOIN ancestors a ON p.id = a.reply_to_id
+        ),
+        descendants(id, reply_to_id, depth) AS (
+            SELECT id, reply_to_id, 0 FROM {table}
+            WHERE id = %s AND deleted_at IS NULL
+            UNION ALL
+            SELECT p.id, p.reply_to_id, d.depth + 1
+            FROM {table} p JOIN descendants d ON p.reply_to_id = d.id
+            WHERE d.depth < %s AND p.deleted_at IS NULL
+        )
+        SELECT id, reply_to_id, depth FROM ancestors WHERE depth < 0
+        UNION ALL
+        SELECT id, reply_to_id, depth FROM (
+            SELECT id, reply_to_id, depth FROM descendants
+            ORDER BY depth, id
+            LIMIT %s
+        ) window_rows
+        ORDER BY depth, id
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [post_id, post_id, depth, limit + 1])
+        return cursor.fetchall()
+
+
+def chain_rows(post_ids, follow_replies=True):
+    """
+    Returns (id, reply_to_id, original_post_id) for the posts and every post
+    they lead to through repost originals and, with `follow_replies`, through
+    reply_to, however far up. original_post_id is None unless the post is a
+    repost.
+    """
+    if not post_ids:
+        return []
+    posts = connection.ops.quote_name(models.Post._meta.db_table)
+    reposts = connection.ops.quote_name(models.Repost._meta.db_table)
+    placeholders = ", ".join(["%s"] * len(post_ids))
+    if follow_replies:
+        step = "p.id IN (c.original_post_id, c.reply_to_id)"
+    else:
+        step = "p.id = c.original_post_id"
+    sql = f"""
+        WITH RECURSIVE chain(id, reply_to_id, original_post_id) AS (
+            SELECT p.id, p.reply_to_id, r.original_post_id
+            FROM {posts} p LEFT JOIN {reposts} r ON r.post_id = p.id
+            WHERE p.id IN ({placeholders})
+            UNION
+            SELECT p.id, p.reply_to_id, r.original_post_id
+            FROM chain c JOIN {posts} p ON {step}
+            LEFT JOIN {reposts} r ON r.post_id = p.id
+        )
+        SELECT id, reply_to_id, original_post_id FROM chain
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, list(post_ids))
+        return cursor.fetchall()
@@ -0,0 +1,151 @@
+"""
+Precomputed home timelines for the following feed.
+
+New top-level posts are pushed into every follower's TimelineEntry rows when
+they are written, so reading the feed is a range scan over one account's
+entries. Authors with more than TIMELINE_FANOUT_LIMIT followers are skipped on
+write and merged in on read, and anything older than the stored (trimmed)
+window falls back to the old fan-out-on-read query. Timelines are trimmed as
+posts are pushed into them, see fan_out_post.
+"""
+
+import random
+
+from django.conf import settings
+from social import models
+from social.pagination import Cursor, ordering
+
+BATCH_SIZE = 1000
+
+
+def enabled():
+    return settings.TIMELINE_ENABLED
+
+
+def following_ids(account):
+    return models.Follow.objects.filter(follower=account).values("following")
+
+
+def large_account_ids(account):
+    """Followed accounts whose posts are not fanned out on write."""
+    return list(
+        models.Account.objects.filter(
+            id__in=following_ids(account),
+            follower_count__gt=settings.TIMELINE_FANOUT_LIMIT,
+        ).values_list("id", flat=True)
+    )
+
+
+def top_level_posts():
+    return models.Post.objects.filter(reply_to__isnull=True)
+
+
+def push_entries(account_ids, posts):
+    entries = [
+        models.TimelineEntry(
+            account_id=account_id, post=post, created_at=post.created_at
+        )
+        for account_id in account_ids
+        for post in posts
+    ]
+    models.TimelineEntry.objects.bulk_create(
+        entries, batch_size=BATCH_SIZE, ignore_conflicts=True
+    )
+
+
+def fan_out_post(post):
+    """Pushes a new top-level post into the timelines of its author's followers."""
+    if not enabled() or post.reply_to_id is not None:
+        return
+    if post.account.follower_count > settings.TIMELINE_FANOUT_LIMIT:
+        return
+    follower_ids = list(
+        models.Follow.objects.filter(following=post.account_id).values_list(
+            "follower_id", flat=True
+        )
+    )
+    for start in range(0, len(follower_ids), BATCH_SIZE):
+        push_entries(follower_ids[start : start + BATCH_SIZE], [post])
+    # A sample of the timelines, so each is trimmed about once every
+    # TIMELINE_TRIM_EVERY posts instead of on every write
+    for follower_id in follower_ids:
+        if random.randrange(settings.TIMELINE_TRIM_EVERY) == 0:
+            trim(follower_id)
+
+
+def backfill(follower, following):
+    """Adds the recent posts of a newly followed account to a timeline."""
+    if not enabled():
+        return
+    posts = (
+        top_level_posts()
+        .filter(account=following)
+        .order_by("-created_at")[: settings.TIMELINE_MAX_LENGTH]
+    )
+    push_entries([follower.id], posts)
+    trim(follower.id)
+
+
+def remove(follower, following):
+    """Drops an unfollowed account's posts from a timeline."""
+    if not enabled():
+        return
+    models.TimelineEntry.objects.filter(
+        account=follower, post__account=following
+    ).delete()
+
+
+def trim(account_id):
+    """Keeps only the newest TIMELINE_MAX_LENGTH entries of a timeline."""
+    entries = models.TimelineEntry.objects.filter(account_id=account_id)
+    newest = entries.order_by("-created_at").values_list("created_at", flat=True)
+    cutoff = newest[settings.TIMELINE_MAX_LENGTH - 1 : settings.TIMELINE_MAX_LENGTH]
+    cutoff = next(iter(cutoff), None)
+    if cutoff is None:
+        return 0
+    deleted, _ = entries.filter(created_at__lt=cutoff).delete()
+    return deleted
+
+
+def read(account, cursor, limit):
+    """
+    Returns the ids of candidate following-feed posts after `cursor`, a
+    superset of the newest `limit` of them. Serves from the stored timeline
+    where it can, merges in large accounts, and falls back to fan-out-on-read
+    past the stored window.
+    """
+    # Entries of soft-deleted posts stay until they are reaped, and would
+    # otherwise take up the page
+    entries = list(
+        models.TimelineEntry.objects.filter(
+            cursor.filter(pk_field="post_id"),
+            account=account,
+            post__deleted_at__isnull=True,
+        )
+        .order_by(*ordering(pk_field="post_id"))
+        .values_list("post_id", "created_at")[:limit]
+    )
+    candidates = [post_id for post_id, _ in entries]
+
+    large_ids = large_account_ids(account)
+    if large_ids:
+        candidates += (
+            top_level_posts()
+            .filter(cursor.filter(), account__in=large_ids)
+            .order_by(*ordering())
+            .values_list("id", flat=True)[:limit]
+        )
+
+    if len(entries) < limit:
+        # The stored timeline ends here (trimmed, or written before fan-out
+        # was enabled), so read whatever is left straight from the posts
+        if entries:
+            cursor = Cursor(created_at=entries[-1][1], pk=entries[-1][0])
+        fallback = top_level_posts().filter(
+            cursor.filter(), account__in=following_ids(account)
+        )
+        candidates += fallback.order_by(*ordering()).values_list("id", flat=True)[
+            :limit
+        ]
+
+    return candidates
@@ -0,0 +1,126 @@
+"""
+Streaming validation of image uploads.
+
+ImageUploadHandler is the only FILE_UPLOAD_HANDLERS entry. It writes each
+uploaded file to a temporary file chunk by chunk, so a large upload never sits
+in memory. The magic bytes and dimensions are read from the first chunks, and
+files that are not an accepted image, are too large or have too many pixels
+are skipped as soon as that is known. The rest of a skipped file is read and
+discarded. The reason is recorded on the request for the view to report, see
+upload_error.
+
+The handler also hashes the bytes as they arrive. social.media then does not
+have to read the file again to find its blob name.
+"""
+
+import hashlib
+import io
+import warnings
+
+from django.conf import settings
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+from PIL import Image as PILImage
+
+# Leading bytes of each accepted format
+MAGIC_BYTES = {
+    "JPEG": (b"\xff\xd8\xff",),
+    "PNG": (b"\x89PNG\r\n\x1a\n",),
+    "GIF": (b"GIF87a", b"GIF89a"),
+    "WEBP": (b"RIFF",),
+}
+# How far into a file its dimensions must be found. JPEG metadata can push
+# them well past the first chunk.
+HEADER_LIMIT = 256 * 1024
+# Slack for the non-file fields of a multipart body
+FORM_OVERHEAD = 64 * 1024
+
+
+class UploadRejected(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def detect_format(header):
+    for format, signatures in MAGIC_BYTES.items():
+        if header.startswith(signatures):
+            if format == "WEBP" and header[8:12] != b"WEBP":
+                continue
+            return format
+    return None
+
+
+def too_large(request):
+    """Whether the declared body size already rules out an acceptable upload."""
+    try:
+        content_length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        return False
+    return content_length > settings.IMAGE_UPLOAD_MAX_SIZE + FORM_OVERHEAD
+
+
+def upload_error(request, field_name):
+    """The UploadRejected a file field was skipped with, if any."""
+    return getattr(request, "upload_errors", {}).get(field_name)
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.size = 0
+        self.header = b""
+        self.dimensions = None
+        self.digest = hashlib.sha256()
+
+    def record_error(self, message, status=400):
+        if not hasattr(self.request, "upload_errors"):
+            self.request.upload_errors = {}
+        self.request.upload_errors[self.field_name] = UploadRejected(message, status)
+
+    def reject(self, message, status=400):
+        self.record_error(message, status)
+        raise SkipFile()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.size > settings.IMAGE_UPLOAD_MAX_SIZE:
+            self.reject("File too large", status=413)
+        if self.dimensions is None:
+            self.check_header(raw_data)
+        self.digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def check_header(self, raw_data):
+        """Looks for the format and dimensions in the data received so far."""
+        self.header += raw_data
+        if len(self.header) >= 12 and detect_format(self.header) is None:
+            self.reject("Invalid file provided")
+        try:
+            # Only reads as far as the dimensions, nothing is decoded
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", PILImage.DecompressionBombWarning)
+                header = io.BytesIO(self.header)
+                with PILImage.open(header, formats=list(MAGIC_BYTES)) as img:
+                    self.dimensions = img.size
+        except PILImage.DecompressionBombError:
+            self.reject("Image dimensions too large")
+        except Exception:
+            if len(self.header) >= HEADER_LIMIT:
+                self.reject("Invalid file provided")
+            return
+        self.header = b""
+        width, height = self.dimensions
+        if width * height > settings.IMAGE_UPLOAD_MAX_PIXELS:
+            self.reject("Image dimensions too large")
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if self.dimensions is None:
+            # Ended before its dimensions, so not an image. Raising SkipFile
+            # is not possible here; leaving the file out has the same effect.
+            file.close()
+            self.record_error("Invalid file provided")
+            return None
+        file.content_hash = self.digest.hexdigest()
+        return file
@@ -1,9 +1,9 @@
 from django.contrib import admin
-from django.urls import path
+from django.urls import path, re_path
 from django.conf import settings
-from django.conf.urls.static import static
 
 from .views import *
+from . import media, profiling
 
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
@@ -12,10 +12,18 @@ urlpatterns = [
     path("token/refresh", TokenRefreshView.as_view(), name="token-refresh"),
     path("register", Register.as_view(), name="register"),
     path("post", Post.as_view(), name="post"),
+    path("post/thread", Thread.as_view(), name="post-thread"),
     path("profile", Profile.as_view(), name="profile"),
     path("profile/info", ProfileInfo.as_view(), name="profile-info"),
     path("follow", Follow.as_view(), name="follow"),
     path("account/id", GetAccountId.as_view(), name="get-account-id"),
+    path("account/export", Export.as_view(), name="account-export"),
     path("notification/token", NotificationToken.as_view(), name="notification-token"),
     path("notification", Notification.as_view(), name="notification"),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path("metrics", profiling.metrics, name="metrics"),
+]
+
+if settings.DEBUG:
+    urlpatterns += [
+        re_path(rf"^{settings.MEDIA_URL.lstrip('/')}(?P<path>.*)$", media.serve),
+    ]
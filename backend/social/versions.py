@@ -0,0 +1,56 @@
+"""
+Version stamps for the things a response is built from.
+
+Each scope ("post:<id>", "profile:<username>", ...) holds the nanosecond
+time of its last change in the cache. Writers bump a scope once their
+transaction commits. Readers can tell whether anything changed by comparing
+stamps, without rebuilding the response, see social.conditional. A scope that
+was never bumped or was evicted is stamped on first read. The time never
+repeats, so an eviction can only cause a spurious change, never a missed one.
+"""
+
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def post_scope(post_id):
+    return f"post:{post_id}"
+
+
+def profile_scope(username):
+    return f"profile:{username}"
+
+
+def notifications_scope(account_id):
+    return f"notifications:{account_id}"
+
+
+def relations_scope(kind, account_id):
+    return f"relations:{kind}:{account_id}"
+
+
+def cache_key(scope):
+    return f"version:{scope}"
+
+
+def get_many(scopes):
+    """Returns {scope: stamp} for every scope in one cache round trip."""
+    keys = {cache_key(scope): scope for scope in scopes}
+    found = cache.get_many(keys)
+    stamps = {keys[key]: stamp for key, stamp in found.items()}
+    for key, scope in keys.items():
+        if scope not in stamps:
+            cache.add(key, time.time_ns(), None)
+            stamps[scope] = cache.get(key)
+    return stamps
+
+
+def bump(*scopes):
+    """Stamps the scopes as changed once the current transaction commits."""
+    transaction.on_commit(
+        lambda: cache.set_many(
+            {cache_key(scope): time.time_ns() for scope in scopes}, None
+        )
+    )
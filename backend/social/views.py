@@ -1,17 +1,39 @@
 import html
 import logging
 import secrets
-from PIL import Image as PILImage
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.authentication import JWTAuthentication
-from social import models
+from notification import dispatch
+from social import (
+    conditional,
+    deletion,
+    export,
+    feed_cache,
+    images,
+    models,
+    pagination,
+    profiling,
+    relations,
+    threads,
+    timeline,
+    uploads,
+    versions,
+)
+from social.pagination import PAGE_SIZE, Cursor, InvalidCursor
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.db.models import F
 from django.utils import timezone
-from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
-PAGE_SIZE = 16
+UNREAD_COUNT_HEADER = "X-Unread-Count"
+
+# Smallest suitable image variant first, see social.images
+AVATAR_VARIANTS = ("avatar",)
+FEED_VARIANTS = ("feed", "full")
+BANNER_VARIANTS = ("feed",)
 
 
 class Register(APIView):
@@ -43,86 +65,145 @@ def get_post_content(post):
             return None
 
 
-def is_valid_image_pillow(file_name):
-    try:
-        with PILImage.open(file_name) as img:
-            img.verify()
-            return True
-    except (IOError, SyntaxError):
-        return False
+def get_post_type(post):
+    if hasattr(post, "text_post"):
+        return "text"
+    if hasattr(post, "markdown_post"):
+        return "markdown"
+    if hasattr(post, "image_post"):
+        return "image"
+    return None
 
 
-def serialize_post(post, request_user=None):
+def post_queryset():
     """
-    Serializes a post object into a dictionary containing all post data.
+    Posts with their account, user and subtype rows joined in, so that
+    serialization never has to go back to the database per post.
+    """
+    return models.Post.objects.select_related(
+        "account__user", "text_post", "markdown_post", "image_post"
+    )
+
+
+@profiling.timed("serialize")
+def serialize_posts(posts, request_user=None, nest_replies=True):
+    """
+    Serializes a page of posts in a fixed number of queries.
+    Reply parents and repost originals are collected with one recursive query
+    and loaded together, and the viewer flags are fetched for every collected
+    post in bulk.
     Args:
-        post: Post model instance
+        posts: iterable of Post model instances
         request_user: The currently authenticated user (optional)
+        nest_replies: Whether to embed each reply's parent, or only give its
+            reply_to_id (for callers that serialize the parents themselves)
     """
+    posts = list(posts)
+    if not posts:
+        return []
     account = (
         models.Account.objects.get(user=request_user)
         if request_user and request_user.is_authenticated
         else None
     )
 
-    post_data = {
-        "id": post.id,
-        "account_display_name": post.account.display_name if post.account else None,
-        "account_profile_picture": (
-            post.account.profile_picture.url if post.account.profile_picture else None
-        ),
-        "account_username": post.account.user.username if post.account else None,
-        "account_id": post.account.id if post.account else None,
-        "created_at": post.created_at,
-        "content": get_post_content(post),
-        "favorited": (
-            models.Favorite.objects.filter(account=account, post=post).exists()
-            if account
-            else False
-        ),
-        "reposted": (
-            models.Repost.objects.filter(account=account, original_post=post).exists()
-            if account
-            else False
-        ),
-        "favorite_count": models.Favorite.objects.filter(post=post).count(),
-        "repost_count": models.Repost.objects.filter(original_post=post).count(),
-        "type": (
-            "text"
-            if hasattr(post, "text_post")
-            else (
-                "markdown"
-                if hasattr(post, "markdown_post")
-                else ("image" if hasattr(post, "image_post") else None)
-            )
-        ),
-        "url": (post.image_post.image.url if hasattr(post, "image_post") else None),
-        "is_owner": post.account.user == request_user if account else False,
-        "is_repost": post.repost_post.exists(),
-        "reply_to": (
-            serialize_post(post.reply_to, request_user) if post.reply_to else None
-        ),
-    }
+    # Every post the page embeds, however deep, in one recursive query
+    rows = threads.chain_rows([post.id for post in posts], nest_replies)
+    originals = {id: original_id for id, _, original_id in rows if original_id}
+    loaded = {post.id: post for post in posts}
+    missing = {id for id, _, _ in rows} - loaded.keys()
+    if missing:
+        # Soft-deleted posts are left out, and embedded as None
+        loaded.update(
+            (post.id, post) for post in post_queryset().filter(id__in=missing)
+        )
+
+    ids = list(loaded)
+    favorited = set()
+    reposted = set()
+    if account:
+        cached = relations.get_many(
+            account.id, [relations.FAVORITES, relations.REPOSTS]
+        )
+        favorited = relations.subset(
+            relations.FAVORITES, account.id, ids, cached[relations.FAVORITES]
+        )
+        reposted = relations.subset(
+            relations.REPOSTS, account.id, ids, cached[relations.REPOSTS]
+        )
+
+    def build(post):
+        post_type = get_post_type(post)
+        data = {
+            "id": post.id,
+            "account_display_name": post.account.display_name,
+            "account_profile_picture": images.variant_url(
+                post.account.profile_picture_variants, AVATAR_VARIANTS
+            ),
+            "account_username": post.account.user.username,
+            "account_id": post.account.id,
+            "created_at": post.created_at,
+            "content": get_post_content(post),
+            "favorited": post.id in favorited,
+            "reposted": post.id in reposted,
+            "favorite_count": post.favorite_count,
+            "repost_count": post.repost_count,
+            "type": post_type,
+            # Nothing is served until the workers have verified the upload
+            "url": (
+                images.variant_url(post.image_post.variants, FEED_VARIANTS)
+                if post_type == "image" and post.image_post.state == images.READY
+                else None
+            ),
+            "image_state": post.image_post.state if post_type == "image" else None,
+            "is_owner": post.account.user_id == request_user.id if account else False,
+            "is_repost": post.id in originals,
+            "original_post": embed(originals.get(post.id)),
+        }
+        if nest_replies:
+            data["reply_to"] = embed(post.reply_to_id)
+        else:
+            data["reply_to_id"] = post.reply_to_id
+        return data
+
+    def embed(post_id):
+        post = loaded.get(post_id)
+        return build(post) if post is not None else None
 
-    # Add original post data if this is a repost
-    if post.repost_post.exists():
-        original_post = post.repost_post.first().original_post
-        post_data["original_post"] = serialize_post(original_post, request_user)
-    else:
-        post_data["original_post"] = None
+    return [build(post) for post in posts]
 
-    return post_data
+
+def anonymous_feed_page(cursor):
+    """One page of the global feed as a logged-out viewer sees it."""
+    posts, next_cursor = pagination.paginate(
+        post_queryset().filter(reply_to__isnull=True), cursor
+    )
+    return serialize_posts(posts), next_cursor
+
+
+def serialize_post(post, request_user=None):
+    """
+    Serializes a post object into a dictionary containing all post data.
+    Args:
+        post: Post model instance
+        request_user: The currently authenticated user (optional)
+    """
+    return serialize_posts([post], request_user)[0]
 
 
 class Post(APIView):
     authentication_classes = [JWTAuthentication]
 
+    @transaction.atomic
     def post(self, request):
         if not request.user.is_authenticated:
             return Response({"message": "Not logged in"}, status=401)
-        
+        # Refused before any of the body is read
+        if uploads.too_large(request):
+            return Response({"message": "File too large"}, status=413)
+
         data = request.data
-        account = models.Account.objects.get(user=request.user)
+        account = models.Account.objects.select_related("user").get(user=request.user)
         reply_id = data.get("reply_id")
         reply_post = models.Post.objects.get(id=reply_id) if reply_id else None
         action = None
@@ -135,6 +216,7 @@ class Post(APIView):
                 content=data["content"],
             )
             if reply_post:
+                models.adjust_post_counter(reply_post.id, "reply_count", 1)
                 action = "replied"
         elif type == "markdown":
             post = models.Post.objects.create(account=account, reply_to=reply_post)
@@ -144,6 +226,7 @@ class Post(APIView):
                 content=data["content"],
             )
             if reply_post:
+                models.adjust_post_counter(reply_post.id, "reply_count", 1)
                 action = "replied"
         elif type == "favorite":
             post = models.Post.objects.get(id=data["post_id"])
@@ -151,8 +234,12 @@ class Post(APIView):
                 account=account,
                 post=post,
             )
+            relations.invalidate(relations.FAVORITES, account.id)
+            versions.bump(versions.post_scope(post.id))
             if entry[1] == False:
-                entry[0].delete()
+                # A concurrent unfavorite may have removed it first
+                if entry[0].delete()[0]:
+                    models.adjust_post_counter(post.id, "favorite_count", -1)
                 models.Notification.objects.filter(
                     account=post.account,
                     post=post,
@@ -160,6 +247,7 @@ class Post(APIView):
                     action_account=account,
                 ).delete()
                 return Response({"message": "Unfavorited successfully"})
+            models.adjust_post_counter(post.id, "favorite_count", 1)
             action = "favorited"
         elif type == "repost":
             original_post = models.Post.objects.get(id=data["post_id"])
@@ -167,37 +255,55 @@ class Post(APIView):
                 account=account,
                 original_post=original_post,
             )
+            relations.invalidate(relations.REPOSTS, account.id)
+            versions.bump(versions.post_scope(original_post.id))
             if entry[1] == False:
                 post = entry[0].post
-                entry[0].delete()
-                post.delete()
+                # Deleting the repost's post on its own already uncounted it
+                if (
+                    entry[0].delete()[0]
+                    and post is not None
+                    and post.deleted_at is None
+                ):
+                    models.adjust_post_counter(original_post.id, "repost_count", -1)
+                    if post.reply_to_id:
+                        models.adjust_post_counter(post.reply_to_id, "reply_count", -1)
+                    deletion.soft_delete(post)
                 models.Notification.objects.filter(
                     account=original_post.account,
                     post=original_post,
                     action="reposted",
                     action_account=account,
                 ).delete()
+                feed_cache.invalidate()
                 return Response({"message": "Unreposted successfully"})
             else:
                 entry[0].post = models.Post.objects.create(
                     account=account, reply_to=reply_post
                 )
                 entry[0].save()
+                models.adjust_post_counter(original_post.id, "repost_count", 1)
+                if reply_post:
+                    models.adjust_post_counter(reply_post.id, "reply_count", 1)
                 action = "reposted"
                 post = original_post
         elif type == "image":
-            if not data["image"]:
+            error = uploads.upload_error(request, "image")
+            if error:
+                return Response({"message": error.message}, status=error.status)
+            if not data.get("image"):
                 return Response({"message": "No image provided"}, status=400)
             image = data["image"]
-            if not is_valid_image_pillow(image):
-                return Response({"message": "Invalid file provided"}, status=400)
             post = models.Post.objects.create(account=account, reply_to=reply_post)
-            models.ImagePost.objects.create(
+            image_post = models.ImagePost.objects.create(
                 post=post,
                 image=image,
                 caption=data["caption"],
+                state=images.PENDING,
             )
+            images.process_image_post(image_post)
             if reply_post:
+                models.adjust_post_counter(reply_post.id, "reply_count", 1)
                 action = "replied"
         else:
             return Response({"message": "Invalid post type"}, status=400)
@@ -209,57 +315,68 @@ class Post(APIView):
                 action=action,
                 action_account=account,
             )
+        if type in ("text", "markdown", "image"):
+            timeline.fan_out_post(post)
+            feed_cache.invalidate()
+        elif type == "repost":
+            timeline.fan_out_post(entry[0].post)
+            feed_cache.invalidate()
         return Response({"message": "Post created successfully"})
 
+    @conditional.conditional(conditional.post_validator)
     def get(self, request):
+        # Logged-out responses are the same for everyone, see social.feed_cache
+        cached = not request.user.is_authenticated and feed_cache.enabled()
         if request.GET.get("id"):
-            post = models.Post.objects.get(id=request.GET.get("id"))
+            post_id = int(request.GET.get("id"))
+            if cached:
+                # Keyed by the ETag, so counters never lag behind it
+                return Response(
+                    feed_cache.get_or_compute(
+                        feed_cache.post_key(post_id, request.etag),
+                        lambda: serialize_post(post_queryset().get(id=post_id), None),
+                    )
+                )
+            post = post_queryset().get(id=post_id)
             return Response(
                 serialize_post(
                     post, request.user if request.user.is_authenticated else None
                 )
             )
-        timestamp = int(request.GET.get("timestamp", datetime.now().timestamp() * 1000))
-        time_from = datetime.fromtimestamp(timestamp / 1000)
+        try:
+            cursor = Cursor.from_request(request)
+        except InvalidCursor:
+            return pagination.invalid_cursor_response()
         replies = request.GET.get("replies", False)
         followingFeed = request.GET.get("following", False)
         if replies == False:  # Get all posts (that aren't replies)
             if followingFeed:  # Get posts from users that the user is following
                 account = models.Account.objects.get(user=request.user)
-                following = models.Follow.objects.filter(follower=account)
-                posts = (
-                    models.Post.objects.filter(
-                        account__in=[f.following for f in following]
+                if timeline.enabled():
+                    post_ids = timeline.read(account, cursor, PAGE_SIZE + 1)
+                    posts = post_queryset().filter(id__in=post_ids)
+                else:
+                    posts = post_queryset().filter(
+                        account__in=timeline.following_ids(account)
                     )
-                    .order_by("-created_at")
-                    .exclude(reply_to__isnull=False)
-                    .filter(created_at__lte=time_from)[0:PAGE_SIZE]
+                posts = posts.filter(reply_to__isnull=True)
+            elif cached:
+                post_data, next_cursor = feed_cache.get_or_compute(
+                    feed_cache.feed_key(cursor), lambda: anonymous_feed_page(cursor)
                 )
+                return pagination.paginated_response(post_data, next_cursor)
             else:  # Else get all posts
-                posts = (
-                    models.Post.objects.all()
-                    .order_by("-created_at")
-                    .exclude(reply_to__isnull=False)
-                    .filter(created_at__lte=time_from)[0:PAGE_SIZE]
-                )
+                posts = post_queryset().filter(reply_to__isnull=True)
         else:  # Get replies to a specific post
             post = models.Post.objects.get(id=int(replies))
-            posts = (
-                models.Post.objects.filter(reply_to=post)
-                .order_by("-created_at")
-                .filter(created_at__lte=time_from)[0:PAGE_SIZE]
-            )
-        account = (
-            models.Account.objects.get(user=request.user)
-            if request.user.is_authenticated
-            else None
+            posts = post_queryset().filter(reply_to=post)
+        posts, next_cursor = pagination.paginate(posts, cursor)
+        post_data = serialize_posts(
+            posts, request.user if request.user.is_authenticated else None
         )
-        post_data = [
-            serialize_post(p, request.user if request.user.is_authenticated else None)
-            for p in posts
-        ]
-        return Response(post_data)
+        return pagination.paginated_response(post_data, next_cursor)
 
+    @transaction.atomic
     def delete(self, request):
         post_id = request.GET.get("id")
         post = models.Post.objects.get(id=post_id)
@@ -267,28 +384,88 @@ class Post(APIView):
             return Response(
                 {"detail": "You do not have permission to delete this post"}, status=403
             )
-        models.Notification.objects.filter(post=post).delete()
-        post.delete()
+        if post.reply_to_id:
+            models.adjust_post_counter(post.reply_to_id, "reply_count", -1)
+        # A repost is undone now, so the original shows it and counts it no more
+        for repost in models.Repost.objects.filter(post=post):
+            # A concurrent unrepost may have removed it first
+            if repost.delete()[0]:
+                models.adjust_post_counter(repost.original_post_id, "repost_count", -1)
+                relations.invalidate(relations.REPOSTS, post.account_id)
+                versions.bump(versions.post_scope(repost.original_post_id))
+        # Hidden now, removed with its replies by reap_deleted_posts
+        deletion.soft_delete(post)
+        feed_cache.invalidate()
+        versions.bump(versions.post_scope(post_id))
         return Response({"message": "Post deleted successfully"})
 
 
+class Thread(APIView):
+    authentication_classes = [JWTAuthentication]
+
+    def get(self, request):
+        """
+        A post with all of its ancestors and a window of its descendants, as
+        a map of flat nodes. `depth` bounds how many replies down the window
+        goes and `limit` how many descendants it holds.
+        """
+        try:
+            post_id = int(request.GET["id"])
+            depth = int(request.GET.get("depth", threads.DEFAULT_DEPTH))
+            limit = int(request.GET.get("limit", threads.DEFAULT_LIMIT))
+        except (KeyError, ValueError):
+            return Response({"message": "Invalid thread request"}, status=400)
+        rows = threads.thread_rows(
+            post_id,
+            max(min(depth, threads.MAX_DEPTH), 0),
+            max(min(limit, threads.MAX_LIMIT), 0),
+        )
+        if not rows:
+            return Response({"message": "Post not found"}, status=404)
+
+        posts = sorted(
+            post_queryset().filter(id__in=[row[0] for row in rows]),
+            key=lambda post: (post.created_at, post.id),
+        )
+        nodes = serialize_posts(
+            posts,
+            request.user if request.user.is_authenticated else None,
+            nest_replies=False,
+        )
+        children = {}
+        for post in posts:
+            if post.reply_to_id is not None:
+                children.setdefault(post.reply_to_id, []).append(post.id)
+        for node, post in zip(nodes, posts):
+            node["reply_count"] = post.reply_count
+            # Replies left out of the window, to be fetched from that node
+            node["has_more_replies"] = post.reply_count > len(children.get(post.id, []))
+        return Response(
+            {
+                "id": post_id,
+                # Root first
+                "ancestors": [id for id, _, depth in rows if depth < 0],
+                "nodes": {node["id"]: node for node in nodes},
+                "children": children,
+            }
+        )
+
+
 class Profile(APIView):
     authentication_classes = [JWTAuthentication]
 
     def get(self, request):
-        timestamp = int(request.GET.get("timestamp", datetime.now().timestamp() * 1000))
-        time_from = datetime.fromtimestamp(timestamp / 1000)
+        try:
+            cursor = Cursor.from_request(request)
+        except InvalidCursor:
+            return pagination.invalid_cursor_response()
         username = request.GET.get("username")
-        account = models.Account.objects.get(
-            user=models.User.objects.get(username=username)
-        )
-        posts = (
-            models.Post.objects.filter(account=account)
-            .order_by("-created_at")
-            .filter(created_at__lte=time_from)[0:PAGE_SIZE]
+        account = models.Account.objects.get(user__username=username)
+        posts, next_cursor = pagination.paginate(
+            post_queryset().filter(account=account), cursor
         )
-        post_data = [serialize_post(post, request.user) for post in posts]
-        return Response(post_data)
+        post_data = serialize_posts(posts, request.user)
+        return pagination.paginated_response(post_data, next_cursor)
 
 
 class GetAccountId(APIView):
@@ -300,6 +477,35 @@ class GetAccountId(APIView):
         return Response({"id": account.id})
 
 
+class Export(APIView):
+    authentication_classes = [JWTAuthentication]
+
+    def get(self, request):
+        """
+        Everything the account has posted, followed, favorited and reposted,
+        and its notifications, streamed as NDJSON. `cursor` resumes after the
+        line carrying it.
+        """
+        if not request.user.is_authenticated:
+            return Response({"message": "Not logged in"}, status=401)
+        cursor = request.GET.get("cursor")
+        if cursor:
+            try:
+                export.decode_cursor(cursor)
+            except InvalidCursor:
+                return pagination.invalid_cursor_response()
+        account = models.Account.objects.get(user=request.user)
+        blocks = export.lines(account, cursor or None)
+        response = StreamingHttpResponse(
+            export.streaming_content(request, blocks),
+            content_type=export.CONTENT_TYPE,
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="{request.user.username}.ndjson"'
+        )
+        return response
+
+
 class Follow(APIView):
     authentication_classes = [JWTAuthentication]
 
@@ -312,13 +518,15 @@ class Follow(APIView):
             following = models.Account.objects.get(user__username=username)
             return Response(
                 {
-                    "following": models.Follow.objects.filter(
-                        follower=account, following=following
-                    ).exists()
+                    "following": relations.contains(
+                        relations.FOLLOWING, account.id, following.id
+                    )
                 }
             )
         else:  # Returns all users that the user is following
-            following = models.Follow.objects.filter(follower=account)
+            following = models.Follow.objects.filter(follower=account).select_related(
+                "following__user"
+            )
             following_data = [
                 {
                     "id": f.following.id,
@@ -329,18 +537,28 @@ class Follow(APIView):
             ]
             return Response(following_data)
 
+    @transaction.atomic
     def post(self, request):
         if not request.user.is_authenticated:
             return Response({"message": "Not logged in"}, status=401)
         data = request.data
-        follower = models.Account.objects.get(user=request.user)
+        follower = models.Account.objects.select_related("user").get(user=request.user)
         following = models.Account.objects.get(user__username=data["username"])
         object = models.Follow.objects.get_or_create(
             follower=follower,
             following=following,
         )
+        relations.invalidate(relations.FOLLOWING, follower.id)
+        versions.bump(
+            versions.profile_scope(follower.user.username),
+            versions.profile_scope(data["username"]),
+        )
         if object[1] == False:
             object[0].delete()
+            models.Account.objects.filter(id=following.id, follower_count__gt=0).update(
+                follower_count=F("follower_count") - 1
+            )
+            timeline.remove(follower, following)
             models.Notification.objects.filter(
                 account=following,
                 post=None,
@@ -349,6 +567,10 @@ class Follow(APIView):
             ).delete()
             return Response({"message": "Unfollowed successfully"})
         else:
+            models.Account.objects.filter(id=following.id).update(
+                follower_count=F("follower_count") + 1
+            )
+            timeline.backfill(follower, following)
             models.Notification.objects.create(
                 account=following,
                 post=None,
@@ -361,6 +583,7 @@ class Follow(APIView):
 class ProfileInfo(APIView):
     authentication_classes = [JWTAuthentication]
 
+    @conditional.conditional(conditional.profile_info_validator)
     def get(self, request):
         username = request.GET.get("username")
         account = models.Account.objects.get(user__username=username)
@@ -374,22 +597,24 @@ class ProfileInfo(APIView):
                 "username": account.user.username,
                 "is_owner": account.user == request.user,
                 "is_following": (
-                    models.Follow.objects.filter(
-                        follower=request.user.account, following=account
-                    ).exists()
+                    relations.contains(
+                        relations.FOLLOWING, request.user.account.id, account.id
+                    )
                     if request.user.is_authenticated
                     else False
                 ),
-                "profile_picture": (
-                    account.profile_picture.url if account.profile_picture else None
+                "profile_picture": images.variant_url(
+                    account.profile_picture_variants, AVATAR_VARIANTS
                 ),
-                "banner_picture": (
-                    account.banner_picture.url if account.banner_picture else None
+                "banner_picture": images.variant_url(
+                    account.banner_picture_variants, BANNER_VARIANTS
                 ),
             }
         )
 
     def post(self, request):
+        if uploads.too_large(request):
+            return Response({"message": "File too large"}, status=413)
         data = request.data
         if not request.user.is_authenticated:
             return Response({"message": "Not logged in"}, status=401)
@@ -398,18 +623,43 @@ class ProfileInfo(APIView):
             return Response({"message": "Not authorized"}, status=403)
         account = models.Account.objects.get(user=request.user)
         if data["type"] == "pfp":
-            if not is_valid_image_pillow(data["file"]):
-                return Response({"message": "Invalid file provided"}, status=400)
+            error = uploads.upload_error(request, "file")
+            if error:
+                return Response({"message": error.message}, status=error.status)
+            if not data.get("file"):
+                return Response({"message": "No file provided"}, status=400)
             account.profile_picture = data["file"]
-            account.save()
+            account.profile_picture_state = images.PENDING
+            # Only the profile fields, as the counters on the row change under us
+            account.save(
+                update_fields=[
+                    "profile_picture",
+                    "profile_picture_variants",
+                    "profile_picture_state",
+                ]
+            )
+            images.process_account_picture(account, "profile_picture")
         if data["type"] == "banner":
-            if not is_valid_image_pillow(data["file"]):
-                return Response({"message": "Invalid file provided"}, status=400)
+            error = uploads.upload_error(request, "file")
+            if error:
+                return Response({"message": error.message}, status=error.status)
+            if not data.get("file"):
+                return Response({"message": "No file provided"}, status=400)
             account.banner_picture = data["file"]
-            account.save()
+            account.banner_picture_state = images.PENDING
+            account.save(
+                update_fields=[
+                    "banner_picture",
+                    "banner_picture_variants",
+                    "banner_picture_state",
+                ]
+            )
+            images.process_account_picture(account, "banner_picture")
         if data["type"] == "display_name":
             account.display_name = data["display_name"]
-            account.save()
+            account.save(update_fields=["display_name"])
+        feed_cache.invalidate()
+        versions.bump(versions.profile_scope(username))
         return Response({"message": "Profile updated successfully"})
 
 
@@ -433,12 +683,13 @@ class NotificationToken(APIView):
         return Response({"token": secure_token})
 
 
+@profiling.timed("serialize")
 def serialize_notification(notification):
     return {
         "action_account_displayname": notification.action_account.display_name,
         "action_account": notification.action_account.user.username,
         "action": notification.action,
-        "post_id": notification.post.id if notification.post else None,
+        "post_id": notification.post_id,
         "created_at": notification.created_at,
         "read": notification.read,
         "notification_id": notification.id,
@@ -448,19 +699,28 @@ def serialize_notification(notification):
 class Notification(APIView):
     authentication_classes = [JWTAuthentication]
 
+    @conditional.conditional(conditional.notifications_validator)
     def get(self, request):
-        timestamp = int(request.GET.get("timestamp", datetime.now().timestamp() * 1000))
-        time_from = datetime.fromtimestamp(timestamp / 1000)
         if not request.user.is_authenticated:
             return Response({"message": "Not logged in"}, status=401)
+        try:
+            cursor = Cursor.from_request(request)
+        except InvalidCursor:
+            return pagination.invalid_cursor_response()
         account = models.Account.objects.get(user=request.user)
-        notifications = models.Notification.objects.filter(account=account).order_by(
-            "-created_at"
+        notifications, next_cursor = pagination.paginate(
+            models.visible_notifications(account.id).select_related(
+                "action_account__user"
+            ),
+            cursor,
+        )
+        response = pagination.paginated_response(
+            [serialize_notification(n) for n in notifications], next_cursor
         )
-        notifications = notifications.filter(created_at__lte=time_from)
-        notifications = notifications[0:PAGE_SIZE]
-        return Response([serialize_notification(n) for n in notifications])
+        response[UNREAD_COUNT_HEADER] = account.unread_notification_count
+        return response
 
+    @transaction.atomic
     def post(self, request):
         if not request.user.is_authenticated:
             return Response({"message": "Not logged in"}, status=401)
@@ -469,14 +729,29 @@ class Notification(APIView):
         if data["type"] == "read":
             notification_id = data["notification_id"]
             notification = models.Notification.objects.get(id=notification_id)
-            if notification.account != account:
+            if notification.account_id != account.id:
                 return Response({"message": "Not authorized"}, status=403)
-            notification.read = True
-            notification.save()
+            if models.Notification.objects.filter(
+                id=notification.id, read=False
+            ).update(read=True):
+                models.adjust_unread_count(account.id, -1)
+                versions.bump(versions.notifications_scope(account.id))
             return Response({"message": "Notification read successfully"})
         elif data["type"] == "all":
-            notifications = models.Notification.objects.filter(account=account)
-            for notification in notifications:
-                notification.read = True
-                notification.save()
+            # One UPDATE, optionally bounded by the newest id the client has seen
+            unread = models.Notification.objects.filter(account=account, read=False)
+            up_to = data.get("up_to")
+            if up_to is not None:
+                try:
+                    up_to = int(up_to)
+                except (TypeError, ValueError):
+                    return Response({"message": "Invalid up_to"}, status=400)
+                unread = unread.filter(id__lte=up_to)
+            # Relative, so notifications created meanwhile stay counted
+            models.adjust_unread_count(account.id, -unread.update(read=True))
+            unread_count = models.Account.objects.values_list(
+                "unread_notification_count", flat=True
+            ).get(id=account.id)
+            dispatch.enqueue(account.id, dispatch.read_event(up_to, unread_count))
+            versions.bump(versions.notifications_scope(account.id))
             return Response({"message": "All notifications read successfully"})
@@ -9,6 +9,7 @@ export type Post = {
   is_repost: boolean;
   type: string;
   url?: string;
+  image_state?: string;
   favorited: boolean;
   favorite_count: number;
   reposted: boolean;